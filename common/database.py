@@ -1,7 +1,7 @@
 # common/database.py
 import os
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 from dotenv import load_dotenv
 
 
@@ -13,16 +13,35 @@ DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("POSTGRES_DB", "gemini")
 
+# 连接池配置：会话开关非常频繁 (每个任务/每条错误日志)，池子要足够大，避免反复建连 + 认证
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 20))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 40))
+# 借出连接前是否先 SELECT 1 探活：默认开启，网关等长驻进程靠它剔除数据库重启/网络闪断后的死连接。
+# 对延迟敏感的 Worker 可设 DB_POOL_PRE_PING=false 省掉每次借连接的一次往返，改由 pool_recycle 淘汰陈旧连接
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# 编译语句缓存容量：调大一些，保证常驻 Worker / 网关的固定查询始终命中缓存
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", 1200))
+
 SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 print(f"🔌 Database URL: postgresql://{DB_USER}:***@{DB_HOST}:{DB_PORT}/{DB_NAME}")
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    pool_pre_ping=True,
-    pool_recycle=3600
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    pool_recycle=1800,
+    pool_use_lifo=True,  # 优先复用最近归还的热连接，空闲连接可被自然回收
+    query_cache_size=DB_QUERY_CACHE_SIZE
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Worker 专用：每个线程一个常驻 Session，不再每个任务 new 一个
+# expire_on_commit=False：提交后不让已加载的对象过期，避免后续访问属性时再回库 SELECT
+WorkerSession = scoped_session(
+    sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+)
 Base = declarative_base()
 
 def get_db():
@@ -0,0 +1,75 @@
+# common/db_fast.py
+"""
+热路径数据库快速通道
+
+Worker 每处理一条消息都会执行 抢占 / 失败 / 成功 这几条固定 SQL。
+这里在连接池每建立一条新连接时就用 PREPARE 在服务端注册好执行计划，
+之后直接在 Session 当前持有的 psycopg2 连接上 EXECUTE，
+跳过 SQLAlchemy 的语句编译、结果封装和事件钩子，同时复用 Postgres 的已解析计划。
+
+注意：语句跑在 Session 自己的连接和事务里，提交/回滚仍由调用方的 db.commit()/db.rollback() 负责。
+"""
+from sqlalchemy import event
+
+from common.database import engine
+from common.models import TaskStatus
+
+PREPARED_STATEMENTS = {
+    # $1 task_id, $2 processing, $3 now
+    # SKIP LOCKED：别的 Worker 正持有该行锁时直接判负，而不是排队等锁释放
+    # PENDING 直接写成字面量：通用计划下 status = $n 匹配不上部分索引 ix_task_pending (WHERE status = 0)
+    "claim_task": (
+        "UPDATE ai_tasks SET status = $2, updated_at = $3 "
+        "WHERE id = ("
+        f"SELECT id FROM ai_tasks WHERE task_id = $1 AND status = {int(TaskStatus.PENDING)} "
+        "FOR UPDATE SKIP LOCKED LIMIT 1"
+        ") "
+        "RETURNING id"
+    ),
+    # $1 task_id, $2 failed, $3 error_msg, $4 now
+    # 已成功的任务不再改写：迟到的失败 (如超时后消息被别的消费者接管并跑成功) 不能覆盖 SUCCESS
+    "fail_task": (
+        "UPDATE ai_tasks SET status = $2, error_msg = $3, updated_at = $4 "
+        f"WHERE task_id = $1 AND status != {int(TaskStatus.SUCCESS)} "
+        "RETURNING id"
+    ),
+    # $1 task_id, $2 success, $3 response_text, $4 cost_time, $5 now, $6 conversation_id (可为 NULL)
+    # 写结果 + 刷新会话活跃时间合并成一条 CTE：任务行不存在时不动会话，$6 为 NULL 时匹配不到任何会话
+    "finish_task": (
+        "WITH done AS ("
+        "UPDATE ai_tasks SET status = $2, response_text = $3, cost_time = $4, updated_at = $5 "
+        "WHERE task_id = $1 "
+        "RETURNING id"
+        "), touched AS ("
+        "UPDATE ai_conversations SET updated_at = $5 "
+        "WHERE conversation_id = $6 AND EXISTS (SELECT 1 FROM done)"
+        ") "
+        "SELECT id FROM done"
+    ),
+}
+
+
+@event.listens_for(engine, "connect")
+def _prepare_statements(dbapi_connection, connection_record):
+    """新连接建立时注册所有预处理语句 (PREPARE 是连接级的，跨事务有效)"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, sql in PREPARED_STATEMENTS.items():
+            cursor.execute(f"PREPARE {name} AS {sql}")
+    finally:
+        cursor.close()
+    dbapi_connection.commit()
+
+
+def execute_prepared(db, name, *params):
+    """
+    在 Session 当前连接上执行预处理语句
+    :return: 有 RETURNING 时返回第一行 (tuple)，否则/无匹配行返回 None
+    """
+    placeholders = ", ".join(["%s"] * len(params))
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+        return cursor.fetchone() if cursor.description else None
+    finally:
+        cursor.close()
@@ -1,8 +1,14 @@
-# common/worker_utils.py
+# common/logger.py
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
 import traceback
 import os
 from datetime import datetime
-from logging import DEBUG
+from logging.handlers import QueueHandler, QueueListener
 
 from common.database import SessionLocal
 from common.models import SystemLog
@@ -12,6 +18,108 @@ from common.models import SystemLog
 # 生产环境在 .env 里设为 "False" 即可一键关闭写库功能。
 ENABLE_DB_LOG = os.getenv("ENABLE_DB_LOG", "True").lower() == "true"
 
+# === 异步控制台输出 ===
+# 业务线程只把 LogRecord 放进队列 (QueueHandler)，真正写 stdout 的只有 QueueListener 一个后台线程，
+# 多线程之间不再争抢 stdout 锁
+_EMOJI_MAP = {
+    "INFO": "ℹ️", "SUCCESS": "✅", "ERROR": "❌", "WARNING": "⚠️",
+    "DEBUG": "🔍", "REQUEST": "📥"
+}
+_LEVEL_MAP = {
+    "INFO": logging.INFO, "SUCCESS": logging.INFO, "REQUEST": logging.INFO,
+    "ERROR": logging.ERROR, "WARNING": logging.WARNING, "DEBUG": logging.DEBUG
+}
+
+# 控制台日志级别：生产环境设 LOG_LEVEL=WARNING 即可关掉逐任务的 INFO 输出，
+# 低于级别的日志在 debug_log 里直接短路，连字符串都不会拼
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+logger = logging.getLogger("ai_task")
+logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+logger.propagate = False  # 不再冒泡到 root，避免 uvicorn 等框架的 handler 重复输出
+
+_stdout_handler = logging.StreamHandler(sys.stdout)
+_stdout_handler.setFormatter(logging.Formatter("[%(asctime)s] %(emoji)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+_console_queue = queue.Queue(-1)
+logger.addHandler(QueueHandler(_console_queue))
+_console_listener = QueueListener(_console_queue, _stdout_handler)
+_console_listener.start()
+atexit.register(_console_listener.stop)  # 退出前把队列里剩余的日志刷完
+
+# === 异步写库 ===
+# log_error 只负责入队，由后台线程攒批后一次 INSERT 多行，避免报错风暴时每条日志都 commit 一次
+_LOG_QUEUE_SIZE = 10000
+_LOG_BATCH_SIZE = 500
+_LOG_FLUSH_INTERVAL = 0.1
+_LOG_DRAIN_TIMEOUT = 5.0  # 进程退出时最多等多久把剩余日志写完 (秒)
+_LOG_Q = queue.Queue(maxsize=_LOG_QUEUE_SIZE)
+_writer_started = False
+_writer_lock = threading.Lock()
+
+
+def _db_log_writer():
+    """
+    后台线程：阻塞等待第一条日志，再把队列里已有的(最多 500 条)一起写入
+    队列里的 threading.Event 是刷盘标记 (见 _drain_db_logs)：它之前入队的日志写完后 set
+    """
+    while True:
+        batch = [_LOG_Q.get()]
+        deadline = time.monotonic() + _LOG_FLUSH_INTERVAL
+        while len(batch) < _LOG_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_LOG_Q.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        rows = [item for item in batch if not isinstance(item, threading.Event)]
+        if rows:
+            db = SessionLocal()
+            try:
+                db.execute(SystemLog.__table__.insert(), rows)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"严重：日志写入数据库失败! ({len(rows)} 条) {e}", extra={"emoji": "⚠️"})
+            finally:
+                db.close()
+
+        for item in batch:
+            if isinstance(item, threading.Event):
+                item.set()
+
+
+def _ensure_writer():
+    global _writer_started
+    if _writer_started:
+        return
+    with _writer_lock:
+        if _writer_started:
+            return
+        threading.Thread(target=_db_log_writer, daemon=True).start()
+        _writer_started = True
+
+
+def _drain_db_logs():
+    """
+    进程退出前把队列里剩余的日志写完：崩溃/退出前最后几条报错往往最值得保留
+    写库线程是 daemon，不等它就会随解释器一起退出；这里放一个刷盘标记进队列，最多等 _LOG_DRAIN_TIMEOUT 秒
+    """
+    if not _writer_started:
+        return
+    drained = threading.Event()
+    try:
+        _LOG_Q.put(drained, timeout=_LOG_DRAIN_TIMEOUT)
+    except queue.Full:
+        return
+    drained.wait(_LOG_DRAIN_TIMEOUT)
+
+
+# 后注册先执行：先把日志写库，再停控制台监听 (写库失败的告警还能打出来)
+atexit.register(_drain_db_logs)
+
 
 def log_error(source: str, message: str, task_id: str = None, error: Exception = None):
     """
@@ -25,48 +133,39 @@ def log_error(source: str, message: str, task_id: str = None, error: Exception =
     # --- 1. 无论开关状态，永远打印到控制台 (标准输出) ---
     # 这是 Docker/K8s 收集日志的标准方式
     display_msg = message if message else str(error)
-    print(f"❌ [ERROR] [{source}] TaskID: {task_id} | {display_msg}")
-
     if error:
         # 简单打印异常原因，避免刷屏；详细堆栈留给数据库
-        print(f"   └── Reason: {str(error)}")
+        display_msg = f"{display_msg}\n   └── Reason: {str(error)}"
+    logger.error(f"[ERROR] [{source}] TaskID: {task_id} | {display_msg}", extra={"emoji": "❌"})
 
-    # --- 2. 根据开关决定是否写数据库 ---
+    # --- 2. 根据开关决定是否写数据库 (只入队，不阻塞调用方) ---
     if ENABLE_DB_LOG:
-        db = SessionLocal()
+        stack_trace = None
+        if error:
+            # 获取完整的堆栈字符串
+            stack_trace = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+            # 如果 message 没填，为了数据库能看懂，使用 error 字符串兜底
+            if not message:
+                message = str(error)
+
         try:
-            stack_trace = None
-            if error:
-                # 获取完整的堆栈字符串
-                stack_trace = "".join(traceback.format_exception(type(error), error, error.__traceback__))
-                # 如果 message 没填，为了数据库能看懂，使用 error 字符串兜底
-                if not message:
-                    message = str(error)
-
-            log = SystemLog(
-                level="ERROR",
-                source=source,
-                task_id=task_id,
-                message=message,
-                stack_trace=stack_trace
-            )
-            db.add(log)
-            db.commit()
-            # 打印一个小的确认，方便开发时知道写入成功了
-            print(f"   └── [已同步至数据库] ID: {log.id}")
-
-        except Exception as e:
-            print(f"⚠️ 严重：日志写入数据库失败! {e}")
-        finally:
-            db.close()
-
-def debug_log(message: str, level: str = "INFO"):
-    """统一的控制台日志输出"""
-    if DEBUG:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        emoji_map = {
-            "INFO": "ℹ️", "SUCCESS": "✅", "ERROR": "❌", "WARNING": "⚠️",
-            "DEBUG": "🔍", "REQUEST": "📥"
-        }
-        emoji = emoji_map.get(level, "•")
-        print(f"[{timestamp}] {emoji} {message}")
\ No newline at end of file
+            _ensure_writer()
+            _LOG_Q.put_nowait({
+                "level": "ERROR",
+                "source": source,
+                "task_id": task_id,
+                "message": message,
+                "stack_trace": stack_trace,
+                "created_at": datetime.now()
+            })
+        except queue.Full:
+            logger.warning("日志队列已满，丢弃本条数据库日志", extra={"emoji": "⚠️"})
+
+def debug_log(message: str, level: str = "INFO", *args):
+    """
+    统一的控制台日志输出 (只入队，由后台线程写 stdout)
+    支持 %-style 惰性参数：debug_log("开始处理: %s", "REQUEST", task_id)，级别不够时不做任何格式化
+    """
+    log_level = _LEVEL_MAP.get(level, logging.INFO)
+    if logger.isEnabledFor(log_level):
+        logger.log(log_level, message, *args, extra={"emoji": _EMOJI_MAP.get(level, "•")})
\ No newline at end of file
@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, String, DateTime, Text, ForeignKey, JSON, Float, Integer, BigInteger
+from sqlalchemy import Column, String, DateTime, Text, ForeignKey, JSON, Float, Integer, BigInteger, SmallInteger, Index, text
 from sqlalchemy.orm import relationship
 import uuid
 from datetime import datetime
@@ -43,7 +43,7 @@ class ConversationRoute(Base):
     __tablename__ = "conversation_routes"
 
     # 联合主键：(conversation_id, slot_id) 唯一确定一条记录
-    conversation_id = Column(String, primary_key=True, index=True)
+    conversation_id = Column(String, primary_key=True)
     slot_id = Column(Integer, primary_key=True)  # 0 或 1
 
     node_url = Column(String, nullable=False)  # http://...:8001
@@ -82,7 +82,8 @@ class Task(Base):
     __tablename__ = "ai_tasks"
 
     id = Column(BigInteger, primary_key=True, index=True, autoincrement=True)
-    task_id = Column(String, unique=True, index=True, default=lambda: str(uuid.uuid4()))
+    # 唯一性由下方 ix_task_id_cov 覆盖索引保证
+    task_id = Column(String, nullable=False, default=lambda: str(uuid.uuid4()))
 
 
     batch_id = Column(String, ForeignKey("chat_batches.batch_id"), nullable=True)
@@ -90,7 +91,7 @@ class Task(Base):
 
     task_type = Column(String, default="TEXT")
     response_text = Column(Text, nullable=True)
-    status = Column(Integer, default=TaskStatus.PENDING, index=True)
+    status = Column(SmallInteger, default=TaskStatus.PENDING, index=True)
     prompt = Column(Text)
 
     file_paths = Column(JSON, nullable=True)
@@ -107,6 +108,24 @@ class Task(Base):
     # 关系
     batch = relationship("ChatBatch", back_populates="tasks")
 
+    __table_args__ = (
+        # 唯一覆盖索引：按 task_id 查状态可直接 index-only scan
+        Index("ix_task_id_cov", "task_id", unique=True, postgresql_include=["status"]),
+        # 部分索引：claim_task 只抢 PENDING 的任务，已完成的历史任务不进索引
+        Index("ix_task_pending", "task_id", postgresql_where=text(f"status = {int(TaskStatus.PENDING)}")),
+    )
+
+
+class NodeStatus:
+    """
+    节点状态取值
+    节点行由外部 Gemini 服务自行心跳写入，列类型保持字符串，这里只统一常量避免散落的魔法字符串
+    """
+    HEALTHY = "HEALTHY"
+    BUSY = "BUSY"
+    RATE_LIMITED = "429_LIMIT"
+    OFFLINE = "OFFLINE"
+
 
 class GeminiServiceNode(Base):
     """
@@ -120,7 +139,7 @@ class GeminiServiceNode(Base):
     worker_id = Column(String, nullable=True)
 
     # 状态: HEALTHY, BUSY, 429_LIMIT, OFFLINE
-    status = Column(String, default="HEALTHY", index=True)
+    status = Column(String, default=NodeStatus.HEALTHY, index=True)
     dispatched_tasks = Column(Integer, default=0)
     current_tasks = Column(Integer, default=0)
 
@@ -132,4 +151,11 @@ class GeminiServiceNode(Base):
 
     # 最后心跳时间
     last_heartbeat = Column(DateTime, default=datetime.now)
-    created_at = Column(DateTime, default=datetime.now)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # 部分索引：心跳巡检只关心未下线的节点，OFFLINE 行不进索引
+        Index("ix_node_heartbeat_live", "last_heartbeat", postgresql_where=text(f"status != '{NodeStatus.OFFLINE}'")),
+        # 部分索引：路由/分发只查 HEALTHY 节点
+        Index("ix_node_healthy", "last_heartbeat", postgresql_where=text(f"status = '{NodeStatus.HEALTHY}'")),
+    )
\ No newline at end of file
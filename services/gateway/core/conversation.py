@@ -1,14 +1,20 @@
 import uuid
 from datetime import datetime
 from typing import Optional, Tuple
+from sqlalchemy import select, bindparam
 from sqlalchemy.orm import Session
 from common import models
 
+# 按业务 ID 查会话 (主键是自增 id，用不了 db.get)；模块级构造一次，每次只换参数，命中编译缓存
+_CONVERSATION_BY_ID = select(models.Conversation).where(
+    models.Conversation.conversation_id == bindparam("conversation_id")
+)
+
 def _get_or_create_conversation(db: Session, conversation_id: Optional[str], prompt: str):
     if conversation_id:
-        conv = db.query(models.Conversation).filter(
-            models.Conversation.conversation_id == conversation_id
-        ).first()
+        conv = db.execute(
+            _CONVERSATION_BY_ID, {"conversation_id": conversation_id}
+        ).scalar_one_or_none()
         if conv:
             return conv
 
@@ -1,13 +1,14 @@
 # services/gateway/core/dispatch.py
 
-import json
 import uuid
 import random
 from typing import List, Optional, Type
 
+import orjson
+
 from sqlalchemy.orm import Session
 from common import models
-from common.models import TaskStatus, GeminiServiceNode
+from common.models import TaskStatus, GeminiServiceNode, NodeStatus
 from common.logger import debug_log
 
 
@@ -34,7 +35,7 @@ def dispatch_to_stream(redis_client, task_payload: dict, optional_stream_key: st
             stream_key = "sd_stream"
 
     # 执行投递
-    redis_client.xadd(stream_key, {"payload": json.dumps(task_payload)})
+    redis_client.xadd(stream_key, {"payload": orjson.dumps(task_payload)})
     return stream_key
 
 
@@ -51,7 +52,7 @@ def _select_target_nodes(
     if node_model and concurrency > 0:
         # 策略：优先选负载最低的健康节点
         available_nodes = db.query(node_model).filter(
-            node_model.status == "HEALTHY"
+            node_model.status == NodeStatus.HEALTHY
         ).order_by(node_model.current_tasks.asc()).limit(10).all()
 
         if available_nodes:
@@ -129,12 +130,12 @@ def _dispatch_single_task(
 
         node_info = target_node_url or "Auto"
         stream_info = target_stream or "Auto"
-        debug_log(f" -> [分发] Task: {new_task.task_id} | Node: {node_info} | Stream: {queue}", "INFO")
+        debug_log(" -> [分发] Task: %s | Node: %s | Stream: %s", "INFO", new_task.task_id, node_info, queue)
     except Exception as e:
         new_task.status = TaskStatus.FAILED
         new_task.error_msg = f"MQ Error: {str(e)}"
         db.commit()
-        debug_log(f"❌ 分发失败: {e}", "ERROR")
+        debug_log("❌ 分发失败: %s", "ERROR", e)
 
     return new_task.task_id
 
@@ -28,9 +28,9 @@ def save_uploaded_files(files: List[UploadFile], upload_dir: str) -> List[str]:
                 shutil.copyfileobj(file.file, buffer)
 
             saved_paths.append(file_path)
-            debug_log(f"📂 文件已保存: {file_path}", "INFO")
+            debug_log("📂 文件已保存: %s", "INFO", file_path)
         except Exception as e:
-            debug_log(f"❌ 文件保存失败 {file.filename}: {e}", "ERROR")
+            debug_log("❌ 文件保存失败 %s: %s", "ERROR", file.filename, e)
             # 可以选择抛出异常或跳过
 
     return saved_paths
\ No newline at end of file
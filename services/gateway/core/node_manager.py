@@ -1,17 +1,37 @@
 import time
 from datetime import datetime, timedelta
-from sqlalchemy import update
+from sqlalchemy import text
 
 from common.database import SessionLocal
-from common.models import GeminiServiceNode
 from common.logger import debug_log
+from common.models import NodeStatus
+
+# 节点下线通知频道 (Worker 侧路由缓存监听此频道做失效)
+NODE_OFFLINE_CHANNEL = "node_offline"
+SWEEP_INTERVAL = 20  # 检查间隔要比超时时间短
+
+# 预编译的巡检语句：条件与 ix_node_heartbeat_live 部分索引一致，规划器只扫描未下线的节点
+# 同一条语句里顺带清理指向这些节点的会话路由，节点下线和路由失效原子生效
+_MARK_OFFLINE_SQL = text(
+    "WITH offlined AS ("
+    "UPDATE gemini_service_nodes "
+    f"SET status = '{NodeStatus.OFFLINE}', dispatched_tasks = 0, current_tasks = 0 "
+    f"WHERE last_heartbeat < :deadline AND status != '{NodeStatus.OFFLINE}' "
+    "RETURNING node_url"
+    "), purged AS ("
+    "DELETE FROM conversation_routes WHERE node_url IN (SELECT node_url FROM offlined) "
+    "RETURNING 1"
+    ") "
+    "SELECT (SELECT count(*) FROM offlined) AS offlined, (SELECT count(*) FROM purged) AS purged"
+)
+_NOTIFY_OFFLINE_SQL = text("SELECT pg_notify(:channel, :payload)")
 
 
 def mark_inactive_nodes_offline(db, timeout_seconds: int = 30) -> int:
     """
     💓 心跳检测与熔断：
     检查所有节点，如果 last_heartbeat 超过 timeout_seconds (默认30秒) 没有更新，
-    则将其状态强制置为 'OFFLINE'。
+    则将其状态强制置为 'OFFLINE'，并删除指向这些节点的会话路由 (单语句、单事务)。
 
     :param db: 数据库 Session
     :param timeout_seconds: 超时阈值，默认 30 秒
@@ -21,43 +41,33 @@ def mark_inactive_nodes_offline(db, timeout_seconds: int = 30) -> int:
         # 计算截止时间：当前时间 - 30秒
         deadline = datetime.now() - timedelta(seconds=timeout_seconds)
 
-        # 构造批量更新语句
-        # 逻辑：把 last_heartbeat < deadline 且当前状态还不是 OFFLINE 的节点，更新为 OFFLINE
-        stmt = (
-            update(GeminiServiceNode)
-            .where(GeminiServiceNode.last_heartbeat < deadline)
-            .where(GeminiServiceNode.status != "OFFLINE")  # 避免重复更新已下线的节点
-            .values(
-                status="OFFLINE",
-                dispatched_tasks=0,  # 可选：下线同时清空预订数，防止任务卡死
-                current_tasks=0  # 可选：重置当前任务数
-            )
-        )
-
-        result = db.execute(stmt)
+        # 批量更新：把 last_heartbeat < deadline 且当前状态还不是 OFFLINE 的节点，更新为 OFFLINE
+        # (下线同时清空预订数与当前任务数，防止任务卡死)
+        row = db.execute(_MARK_OFFLINE_SQL, {"deadline": deadline}).one()
+
+        affected_rows = row.offlined
+        if affected_rows > 0:
+            # 与 UPDATE 同一事务，提交后才会投递，监听方不会读到未提交的状态
+            db.execute(_NOTIFY_OFFLINE_SQL, {"channel": NODE_OFFLINE_CHANNEL, "payload": str(affected_rows)})
+
         db.commit()
 
-        affected_rows = result.rowcount
         if affected_rows > 0:
-            debug_log(f"📉 心跳检测: 已将 {affected_rows} 个超时节点标记为 OFFLINE", "WARNING")
+            debug_log("📉 心跳检测: 已将 %s 个超时节点标记为 OFFLINE，清理路由 %s 条", "WARNING", affected_rows, row.purged)
 
         return affected_rows
 
     except Exception as e:
         db.rollback()
-        debug_log(f"⚠️ 心跳检测执行失败: {e}", "ERROR")
+        debug_log("⚠️ 心跳检测执行失败: %s", "ERROR", e)
         return 0
 
 
 def start_heartbeat_monitor():
-    """每隔 10 秒执行一次数据库检查"""
+    """每隔 20 秒执行一次数据库检查 (整个循环复用同一个 Session)"""
+    db = SessionLocal()
     while True:
-        try:
-            # 手动创建 Session，用完即关
-            db = SessionLocal()
-            mark_inactive_nodes_offline(db, timeout_seconds=30)
-            db.close()
-        except Exception as e:
-            print(f"Monitor Loop Error: {e}")
-
-        time.sleep(20)  # 检查间隔可以比超时时间短，例如10秒查一次
\ No newline at end of file
+        # mark_inactive_nodes_offline 自己捕获异常并 rollback，Session 可以直接复用；
+        # 借出的连接已失效时由 pool_pre_ping (DB_POOL_PRE_PING，默认开启) 兜底
+        mark_inactive_nodes_offline(db, timeout_seconds=30)
+        time.sleep(SWEEP_INTERVAL)
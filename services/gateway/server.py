@@ -9,6 +9,7 @@ from typing import Optional, List
 
 from fastapi import FastAPI, Depends, HTTPException, Form, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select, bindparam
 from sqlalchemy.orm import Session
 from starlette.responses import FileResponse
 from starlette.staticfiles import StaticFiles
@@ -39,6 +40,12 @@ REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
 
 
+# --- 轮询查询语句 ---
+# 按业务 ID 查 (主键是自增 id，用不了 db.get)；模块级构造一次，每次只换参数，命中编译缓存
+_TASK_BY_ID = select(models.Task).where(models.Task.task_id == bindparam("task_id"))
+_BATCH_BY_ID = select(models.ChatBatch).where(models.ChatBatch.batch_id == bindparam("batch_id"))
+
+
 # --- 依赖注入 ---
 def get_db():
     db = SessionLocal()
@@ -91,7 +98,7 @@ def create_chat_task(
     """
     try:
         debug_log("=" * 40, "REQUEST")
-        debug_log(f"收到请求 | Models: {model}", "REQUEST")
+        debug_log("收到请求 | Models: %s", "REQUEST", model)
 
         # 1. 保存文件
         saved_file_paths = save_uploaded_files(files, UPLOAD_DIR)
@@ -143,13 +150,13 @@ def get_task_status(task_id: str, db: Session = Depends(get_db)):
         异常:
             HTTP 404: 任务不存在
         """
-    debug_log(f"查询任务状态: {task_id}", "REQUEST")
-    task = db.query(models.Task).filter(models.Task.task_id == task_id).first()
+    debug_log("查询任务状态: %s", "REQUEST", task_id)
+    task = db.execute(_TASK_BY_ID, {"task_id": task_id}).scalar_one_or_none()
     if not task:
-        debug_log(f"任务未找到: {task_id}", "WARNING")
+        debug_log("任务未找到: %s", "WARNING", task_id)
         raise HTTPException(status_code=404, detail="Task not found")
 
-    debug_log(f"任务 {task_id} 状态: {task.status}", "INFO")
+    debug_log("任务 %s 状态: %s", "INFO", task_id, task.status)
     return task
 
 
@@ -160,7 +167,7 @@ def get_batch_result(batch_id: str, db: Session = Depends(get_db)):
     """
     前端轮询此接口，获取整个 Batch 的执行状态和所有子模型的结果
     """
-    batch = db.query(models.ChatBatch).filter(models.ChatBatch.batch_id == batch_id).first()
+    batch = db.execute(_BATCH_BY_ID, {"batch_id": batch_id}).scalar_one_or_none()
     if not batch:
         raise HTTPException(status_code=404, detail="Batch ID not found")
 
@@ -1,13 +1,17 @@
 # services/workers/core/__init__.py
 
 # 1. 导出 IO 模块
-from .io.message_io import parse_and_validate, recover_pending_tasks
+from .io.message_io import (
+    parse_and_validate, recover_pending_tasks, claim_stalled_messages, ack_message, flush_acks, process_batch
+)
 from .io.upload_file import upload_files_to_downstream
+from .io.http_client import http_session, post_llm, read_error_preview, extract_reply_text, JSON_HEADERS, CONNECT_TIMEOUT
 
 # 2. 导出 Data 模块
-from .data.task_state import claim_task, mark_task_failed, update_node_load
+from .data.task_state import claim_task, mark_task_failed, finish_task_success, flush_task_results, update_node_load
 from .data.context_loader import build_conversation_context
-from .data.auditor import process_ai_result
+from .data.auditor import process_ai_result, reject_refusal
+from .data.result_writer import defer_task_success
 
 # 3. 导出 Dispatch 模块
 from .dispatch.node_manager import acquire_node_with_retry, release_node_safe
@@ -16,18 +20,50 @@ from .dispatch.router import get_database_target_url
 # 4. 导出 Core Runner
 from .runner import run_chat_task
 
+# 5. 导出多进程扇出
+from .process_pool import (
+    run_worker_processes, consumer_name_for_process, default_worker_identity, resolve_process_count, pin_worker_cpu
+)
+
+# 6. 导出主循环退避
+from .backoff import LoopBackoff
+
+# 7. 导出通用消费主循环
+from .consumer import run_consumer_loop
+
 # 定义 __all__ 让 IDE 提示更友好
 __all__ = [
     "parse_and_validate",
     "upload_files_to_downstream",
+    "http_session",
+    "post_llm",
+    "read_error_preview",
+    "extract_reply_text",
+    "JSON_HEADERS",
+    "CONNECT_TIMEOUT",
     "claim_task",
     "mark_task_failed",
+    "finish_task_success",
+    "flush_task_results",
+    "defer_task_success",
     "process_ai_result",
+    "reject_refusal",
     "update_node_load",
     "build_conversation_context",
     "recover_pending_tasks",
+    "claim_stalled_messages",
+    "ack_message",
+    "flush_acks",
+    "process_batch",
     "acquire_node_with_retry",
     "release_node_safe",
     "get_database_target_url",
-    "run_chat_task"
+    "run_chat_task",
+    "run_worker_processes",
+    "consumer_name_for_process",
+    "default_worker_identity",
+    "resolve_process_count",
+    "pin_worker_cpu",
+    "LoopBackoff",
+    "run_consumer_loop"
 ]
\ No newline at end of file
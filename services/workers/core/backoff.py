@@ -0,0 +1,37 @@
+import time
+
+from common.logger import debug_log
+
+
+class LoopBackoff:
+    """
+    ⏳ 主循环异常退避
+    - 指数退避：从 base 秒起每次翻倍，封顶 cap 秒；成功一次立即复位，偶发抖动后马上恢复
+    - 熔断：连续失败达到 failure_threshold 次视为依赖 (Redis/DB) 整体不可用，
+      之后每次固定等 open_delay 秒再试，不再高频重试，告警也只打一次
+    """
+
+    def __init__(self, base=0.1, cap=2.0, failure_threshold=10, open_delay=10.0):
+        self.base = base
+        self.cap = cap
+        self.failure_threshold = failure_threshold
+        self.open_delay = open_delay
+        self.failures = 0
+        self.delay = base
+
+    def success(self):
+        if self.failures >= self.failure_threshold:
+            debug_log("✅ 主循环已恢复 (此前连续失败 %s 次)", "INFO", self.failures)
+        self.failures = 0
+        self.delay = self.base
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.failures == self.failure_threshold:
+                debug_log("🚨 主循环连续失败 %s 次，熔断：每 %ss 重试一次", "ERROR", self.failures, self.open_delay)
+            time.sleep(self.open_delay)
+            return
+
+        time.sleep(self.delay)
+        self.delay = min(self.delay * 2, self.cap)
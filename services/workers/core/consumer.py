@@ -0,0 +1,103 @@
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.logger import debug_log
+from . import (
+    recover_pending_tasks,
+    claim_stalled_messages,
+    process_batch,
+    flush_acks,
+    LoopBackoff
+)
+
+# === 消费主循环配置 (各 Worker 共用同一组环境变量) ===
+# 同一进程内同时在途的请求数 (一批消息交给线程池并发处理)
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 4))
+# 每次 XREADGROUP 最多取多少条：默认等于并发数，一批正好占满线程池。
+# 取得比线程多，多出来的消息只会在本进程队列里排队，其它空闲消费者却拿不到
+READ_BATCH_SIZE = int(os.getenv("READ_BATCH_SIZE", WORKER_CONCURRENCY))
+# 定期用 XAUTOCLAIM 接管挂掉的消费者留下的消息：多久扫一次 (秒)
+CLAIM_INTERVAL = int(os.getenv("CLAIM_INTERVAL", 30))
+# XREADGROUP 阻塞等待时长 (毫秒)：空闲时由 Redis 挂起连接，不再频繁醒来空转。
+# 上限是 CLAIM_INTERVAL：阻塞太久 (或 0 = 无限阻塞) 时空闲队列上的主循环醒不过来，XAUTOCLAIM 巡检就永远不跑了
+READ_BLOCK_MS = int(os.getenv("READ_BLOCK_MS", 10000)) or CLAIM_INTERVAL * 1000
+READ_BLOCK_MS = min(READ_BLOCK_MS, CLAIM_INTERVAL * 1000)
+# 闲置阈值在单条消息最长处理时间之外再留的余量 (毫秒)：建连重试、抢节点、落库都落在这里
+CLAIM_IDLE_MARGIN_MS = 60000
+
+
+def claim_min_idle_ms(message_timeout):
+    """
+    闲置多久的消息算挂掉、可以被 XAUTOCLAIM 接管 (毫秒)；配置了 CLAIM_MIN_IDLE_MS 时以配置为准
+    闲置时间从消息投递时算起，一批里排在后面的消息要先在线程池队列里等前面的跑完，
+    所以阈值至少是 排队轮数 × 单条最长处理时间 + 余量，否则别的消费者会把还没轮到的消息抢走重跑
+
+    :param message_timeout: 单条消息最长处理时间 (秒)
+    """
+    configured = os.getenv("CLAIM_MIN_IDLE_MS")
+    if configured:
+        return int(configured)
+    rounds = math.ceil(READ_BATCH_SIZE / WORKER_CONCURRENCY)
+    return rounds * message_timeout * 1000 + CLAIM_IDLE_MARGIN_MS
+
+
+def run_consumer_loop(redis_client, stream_key, group_name, consumer_name, process_message, message_timeout):
+    """
+    🔁 通用消费主循环：恢复本消费者的挂起消息，然后一直 XREADGROUP 批量消费
+    - 每 CLAIM_INTERVAL 秒顺带 XAUTOCLAIM 一次别人名下闲置过久的消息
+    - 成功结果由 process_message 逐条交给后台写入线程 (提交后由它 ACK)，其余消息整批结束后一次 XACK
+    - 异常时指数退避，连续失败则熔断
+
+    :param process_message: Worker 的消息回调 (message_id, message_data, check_idempotency, ack_buffer, defer_results)
+    :param message_timeout: 单条消息最长处理时间 (秒)，用来推算 XAUTOCLAIM 的闲置阈值
+    """
+    min_idle_ms = claim_min_idle_ms(message_timeout)
+
+    # 1. 仅在启动时恢复一次
+    recover_pending_tasks(
+        redis_client=redis_client,
+        stream_key=stream_key,
+        group_name=group_name,
+        consumer_name=consumer_name,
+        process_callback=process_message
+    )
+
+    executor = ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY)
+    last_claim = float("-inf")  # 进入主循环先扫一次
+    backoff = LoopBackoff()
+    debug_log("进入主循环监听...", "INFO")
+
+    # 2. 主循环
+    while True:
+        try:
+            # 定期接管其它消费者名下闲置过久的消息
+            if time.monotonic() - last_claim >= CLAIM_INTERVAL:
+                last_claim = time.monotonic()
+                claim_stalled_messages(
+                    redis_client, stream_key, group_name, consumer_name,
+                    process_message, executor, min_idle_ms=min_idle_ms
+                )
+
+            # 阻塞读取新消息
+            response = redis_client.xreadgroup(
+                group_name, consumer_name, {stream_key: '>'}, count=READ_BATCH_SIZE, block=READ_BLOCK_MS
+            )
+            backoff.success()
+            if not response:
+                continue
+
+            ack_buffer = []
+            try:
+                for stream, messages in response:
+                    process_batch(
+                        executor, messages, process_message,
+                        check_idempotency=False, ack_buffer=ack_buffer, defer_results=True
+                    )
+            finally:
+                # 成功结果已逐条交给后台写入线程 (提交后由它 ACK)，这里一次性 ACK 其余消息
+                flush_acks(redis_client, stream_key, group_name, ack_buffer)
+        except Exception as e:
+            debug_log("主循环异常: %s", "ERROR", e)
+            backoff.failure()  # 偶发抖动很快重试，Redis 持续不可用时降频，避免死循环刷屏
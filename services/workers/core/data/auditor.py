@@ -1,5 +1,37 @@
+import re
+from functools import lru_cache
+
 from common.logger import debug_log
-from services.workers.core.data.task_state import finish_task_success, mark_task_failed
+from services.workers.core.data.task_state import mark_task_failed, finish_task_success
+
+
+@lru_cache(maxsize=32)
+def _compile_refusal_pattern(keywords):
+    """把一组拒绝词编译成一个正则 (按关键词集合缓存)，扫描一遍文本即可判断是否命中任意一个"""
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords))
+
+def reject_refusal(db, task_id, ai_text, refusal_keywords=None):
+    """
+    🛑 软拒绝检测 (Soft Rejection Check)：内容包含任意一个拒绝关键词时把任务标记为失败 (FAILED)
+    检测是纯 CPU 判断，只有命中时才落库 (一条 fail_task 预处理语句)
+
+    :param refusal_keywords: 拒绝词列表 (List[str])，如果不传则不检查
+    :return: True(命中拒绝，任务已标记失败), False(审核通过)
+    """
+    if not refusal_keywords:
+        return False
+
+    pattern = _compile_refusal_pattern(tuple(refusal_keywords))
+    if pattern.search(ai_text) is None:
+        return False
+
+    error_msg = f"AI 拒绝生成: {ai_text[:100]}..."  # 只截取前100字避免日志过长
+    debug_log("🛑 捕获到软拒绝: %s", "WARNING", error_msg)
+
+    # 拒答不刷新会话时间，与普通失败走同一条预处理语句
+    mark_task_failed(db, task_id, f"生成失败: {ai_text}")
+    return True
+
 
 def process_ai_result(db, task_id, ai_text, cost_time, conversation_id=None, refusal_keywords=None):
     """
@@ -8,28 +40,19 @@ def process_ai_result(db, task_id, ai_text, cost_time, conversation_id=None, ref
     1. 软拒绝检测 (Soft Rejection Check): 检查内容是否包含拒绝关键词
     2. 如果命中 -> 自动标记为失败 (FAILED)
     3. 如果通过 -> 自动标记为成功 (SUCCESS) 并保存
+    检测是纯 CPU 判断，先定好结果再落库，两种分支都只有一条 UPDATE + 一次 commit
 
     :param refusal_keywords: 拒绝词列表 (List[str])，如果不传则不检查
     :return: True(成功保存), False(被拒绝或出错)
     """
     try:
         # --- 1. 软拒绝检测 ---
-        if refusal_keywords:
-            # 检查是否包含任意一个关键词
-            is_refusal = any(keyword in ai_text for keyword in refusal_keywords)
-
-            if is_refusal:
-                error_msg = f"AI 拒绝生成: {ai_text[:100]}..."  # 只截取前100字避免日志过长
-                debug_log(f"🛑 捕获到软拒绝: {error_msg}", "WARNING")
-
-                # 直接调用同文件的失败处理函数
-                mark_task_failed(db, task_id, f"生成失败: {ai_text}")
-                return False
+        if reject_refusal(db, task_id, ai_text, refusal_keywords):
+            return False
 
         # --- 2. 审核通过，保存结果 ---
-        # 直接调用上一轮我们封装好的成功处理函数
         return finish_task_success(db, task_id, ai_text, cost_time, conversation_id)
 
     except Exception as e:
-        debug_log(f"处理 AI 结果时发生异常: {e}", "ERROR")
+        debug_log("处理 AI 结果时发生异常: %s", "ERROR", e)
         return False
@@ -0,0 +1,89 @@
+import os
+import queue
+import threading
+import time
+
+from common import database
+from common.logger import debug_log
+from services.workers.core.data.task_state import flush_task_results
+from services.workers.core.io.message_io import flush_acks
+
+# === 后台结果写入 ===
+# 每条消息拿到 LLM 结果后立刻把 结果 + 消息 ID 入队，不等同批其它消息；
+# 后台线程在一个很短的窗口内攒批落库，提交成功后再 XACK (进程崩在提交前，消息仍在 PEL 里，会被恢复重放)
+_RESULT_QUEUE_SIZE = int(os.getenv("RESULT_QUEUE_SIZE", 256))  # 队列满时处理线程阻塞，形成背压
+_RESULT_BATCH_SIZE = 64  # 一次最多合并多少条结果
+_RESULT_FLUSH_INTERVAL = 0.05  # 攒批窗口 (秒)：第一条结果到达后最多再等这么久
+_RESULT_Q = queue.Queue(maxsize=_RESULT_QUEUE_SIZE)
+_writer_started = False
+_writer_lock = threading.Lock()
+
+
+def _result_writer():
+    """后台线程：阻塞等待第一条结果，再把窗口内到达的(最多 64 条)合并成一次提交"""
+    while True:
+        jobs = [_RESULT_Q.get()]
+        deadline = time.monotonic() + _RESULT_FLUSH_INTERVAL
+        while len(jobs) < _RESULT_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                jobs.append(_RESULT_Q.get(timeout=timeout))
+            except queue.Empty:
+                break
+        _write_jobs(jobs)
+
+
+def _write_jobs(jobs):
+    """把一批 (redis_client, stream_key, group_name, message_id, row) 落库，再 ACK 已提交的那些"""
+    # 1. 结果一次落库 (失败时 flush_task_results 内部逐条重试)
+    written = set()
+    db = database.WorkerSession()
+    try:
+        written = flush_task_results(db, [row for _, _, _, _, row in jobs])
+    except Exception as e:
+        debug_log("❌ 后台写入结果异常: %s", "ERROR", e)
+    finally:
+        db.close()
+
+    # 2. 只 ACK 确实已提交的任务；没写进去的消息留在 PEL 里，由恢复流程重放
+    #    同一个 Stream/Group 的 ACK 合并成一次 XACK
+    acks = {}
+    for redis_client, stream_key, group_name, message_id, row in jobs:
+        if row["task_id"] not in written:
+            continue
+        key = (id(redis_client), stream_key, group_name)
+        acks.setdefault(key, (redis_client, stream_key, group_name, []))[3].append(message_id)
+    for redis_client, stream_key, group_name, ack_ids in acks.values():
+        try:
+            flush_acks(redis_client, stream_key, group_name, ack_ids)
+        except Exception as e:
+            debug_log("❌ 后台 ACK 失败 (消息将由恢复流程重放): %s", "ERROR", e)
+
+
+def _ensure_writer():
+    global _writer_started
+    if _writer_started:
+        return
+    with _writer_lock:
+        if _writer_started:
+            return
+        threading.Thread(target=_result_writer, name="result-writer", daemon=True).start()
+        _writer_started = True
+
+
+def defer_task_success(redis_client, stream_key, group_name, message_id,
+                       task_id, response_text, cost_time, conversation_id=None):
+    """
+    📮 finish_task_success 的异步版本：把成功结果连同它的消息 ID 交给后台线程 (队列满时阻塞，不丢数据)
+    后台线程批量落库 (flush_task_results)，提交成功后才 ACK 这条消息
+    """
+    row = {
+        "task_id": task_id,
+        "response_text": response_text,
+        "cost_time": cost_time,
+        "conversation_id": conversation_id
+    }
+    _ensure_writer()
+    _RESULT_Q.put((redis_client, stream_key, group_name, message_id, row))
@@ -1,17 +1,46 @@
 from datetime import datetime
 
-from requests import Session
+from sqlalchemy import update, values, column, String, Text, Float
+from sqlalchemy.orm import Session
 
-from common import models
-from common.models import TaskStatus
+from common.db_fast import execute_prepared
+from common.models import Task, TaskStatus, Conversation
 from common.logger import debug_log, log_error
-from sqlalchemy import update
 from common.models import GeminiServiceNode
 
+_tasks = Task.__table__
+_conversations = Conversation.__table__
+
+
+def _bulk_finish_stmt(rows):
+    """
+    批量写成功结果：UPDATE ... FROM (VALUES ...) RETURNING task_id
+    一条语句写完整批，且能知道哪些任务真正被写入 (executemany 拿不到逐行结果)
+    """
+    results = values(
+        column("task_id", String),
+        column("response_text", Text),
+        column("cost_time", Float),
+        name="results"
+    ).data([(row["task_id"], row["response_text"], row["cost_time"]) for row in rows])
+
+    return (
+        update(_tasks)
+        .where(_tasks.c.task_id == results.c.task_id)
+        .values(
+            status=int(TaskStatus.SUCCESS),
+            response_text=results.c.response_text,
+            cost_time=results.c.cost_time,
+            updated_at=datetime.now()
+        )
+        .returning(_tasks.c.task_id)
+    )
+
 def claim_task(db: Session, task_id: str) -> bool:
     """
     🔥 核心幂等性函数：尝试认领任务
-    原理：利用数据库原子更新 (UPDATE ... WHERE status=PENDING)
+    原理：利用数据库原子更新 (UPDATE ... WHERE status=PENDING)，
+    子查询 FOR UPDATE SKIP LOCKED 保证并发抢占时输家立即返回，不阻塞在行锁上
 
     :param db: 数据库会话
     :param task_id: 任务ID
@@ -19,24 +48,21 @@ def claim_task(db: Session, task_id: str) -> bool:
     """
     try:
         # 执行原子更新：只有当前是 PENDING 时才更新为 PROCESSING
-        # synchronize_session=False 能提高性能，防止 SQLAlchemy 尝试更新内存对象
-        result = db.query(models.Task).filter(
-            models.Task.task_id == task_id,
-            models.Task.status == TaskStatus.PENDING
-        ).update(
-            {"status": TaskStatus.PROCESSING},
-            synchronize_session=False
+        # RETURNING 有行 = 抢占成功，一次往返即可判定 (服务端预处理语句，见 common/db_fast.py)
+        row = execute_prepared(
+            db, "claim_task",
+            task_id, int(TaskStatus.PROCESSING), datetime.now()
         )
 
         db.commit()
 
-        if result == 1:
-            debug_log(f"🔒 成功锁定任务: {task_id} -> PROCESSING", "INFO")
+        if row is not None:
+            debug_log("🔒 成功锁定任务: %s -> PROCESSING", "INFO", task_id)
             return True
         else:
             # result == 0 说明找不到符合条件(ID匹配且状态为PENDING)的记录
             # 这意味着任务可能正在被别人处理(PROCESSING)或者已经完成(SUCCESS/FAILED)
-            debug_log(f"✋ 任务抢占失败 (已被处理): {task_id}", "WARNING")
+            debug_log("✋ 任务抢占失败 (已被处理): %s", "WARNING", task_id)
             return False
 
     except Exception as e:
@@ -53,14 +79,15 @@ def mark_task_failed(db, task_id, error_msg):
     """
     try:
         if task_id and task_id != "UNKNOWN":
-            task = db.query(models.Task).filter(models.Task.task_id == task_id).first()
-            if task:
-                task.status = TaskStatus.FAILED
-                task.error_msg = str(error_msg)
-                db.commit()
-                debug_log(f"💾 任务已标记为失败: {task_id} - {error_msg}", "WARNING")
+            row = execute_prepared(
+                db, "fail_task",
+                task_id, int(TaskStatus.FAILED), str(error_msg), datetime.now()
+            )
+            db.commit()
+            if row is not None:
+                debug_log("💾 任务已标记为失败: %s - %s", "WARNING", task_id, error_msg)
             else:
-                debug_log(f"⚠️ 标记失败时未找到任务: {task_id}", "WARNING")
+                debug_log("⚠️ 标记失败时未找到任务或任务已成功: %s", "WARNING", task_id)
     except Exception as e:
         db.rollback()
         log_error("TaskHelper", f"更新任务失败状态时数据库错误: {e}", task_id)
@@ -69,43 +96,72 @@ def mark_task_failed(db, task_id, error_msg):
 def finish_task_success(db, task_id, response_text, cost_time, conversation_id=None):
     """
     ✅ 通用任务成功处理逻辑
-    1. 查询任务 (懒加载)
-    2. 更新状态、结果、耗时
-    3. 更新会话时间
-    4. 提交事务
+    更新状态、结果、耗时，并刷新会话时间 (一条 CTE 预处理语句，一次往返)
     """
     try:
-        # 1. 查询任务
-        task = db.query(models.Task).filter(models.Task.task_id == task_id).first()
-
-        if task:
-            # 2. 更新任务字段
-            task.response_text = response_text
-            task.status = TaskStatus.SUCCESS
-            task.cost_time = cost_time
-            task.updated_at = datetime.now()
-
-            # 3. 更新会话最后活跃时间 (如果有)
-            if conversation_id:
-                conv = db.query(models.Conversation).filter(
-                    models.Conversation.conversation_id == conversation_id
-                ).first()
-                if conv:
-                    conv.updated_at = datetime.now()
+        # 任务结果 + 会话最后活跃时间，同一条语句写完
+        row = execute_prepared(
+            db, "finish_task",
+            task_id, int(TaskStatus.SUCCESS), response_text, cost_time, datetime.now(), conversation_id
+        )
+        db.commit()
 
-            db.commit()
-            debug_log(f"✅ 任务完成: {task_id} (耗时: {cost_time}s)", "SUCCESS")
-            return True
-        else:
-            debug_log(f"⚠️ 保存结果时未找到任务: {task_id}", "WARNING")
+        if row is None:
+            debug_log("⚠️ 保存结果时未找到任务: %s", "WARNING", task_id)
             return False
 
+        debug_log("✅ 任务完成: %s (耗时: %ss)", "SUCCESS", task_id, cost_time)
+        return True
+
     except Exception as e:
         db.rollback()
         log_error("WorkerUtils", f"保存任务结果失败: {e}", task_id)
         return False
 
 
+def flush_task_results(db, result_buffer):
+    """
+    💾 批量落库成功结果
+    一条 UPDATE ... FROM VALUES 写所有任务 + 一条 UPDATE 刷新涉及的会话，只 commit 一次。
+    批量写失败时逐条回退到 finish_task_success，保证结果不丢。
+
+    :return: 确实已提交的 task_id 集合 (调用方只 ACK 这些任务对应的消息)
+    """
+    if not result_buffer:
+        return set()
+
+    rows = list(result_buffer)
+    result_buffer.clear()
+
+    try:
+        written = set(db.execute(_bulk_finish_stmt(rows)).scalars())
+
+        conversation_ids = {
+            row["conversation_id"] for row in rows
+            if row["conversation_id"] and row["task_id"] in written
+        }
+        if conversation_ids:
+            db.execute(
+                update(_conversations)
+                .where(_conversations.c.conversation_id.in_(conversation_ids))
+                .values(updated_at=datetime.now())
+            )
+
+        db.commit()
+        debug_log("✅ 批量保存任务结果: %d 个", "SUCCESS", len(written))
+        if len(written) < len(rows):
+            debug_log("⚠️ 批量保存时 %s 个任务未找到", "WARNING", len(rows) - len(written))
+        return written
+
+    except Exception as e:
+        db.rollback()
+        debug_log("⚠️ 批量保存结果失败，逐条重试: %s", "WARNING", e)
+        return {
+            row["task_id"] for row in rows
+            if finish_task_success(db, row["task_id"], row["response_text"], row["cost_time"], row["conversation_id"])
+        }
+
+
 def update_node_load(db, full_api_url, delta):
     """
     更新分发预订数 (dispatched_tasks)
@@ -126,4 +182,5 @@ def update_node_load(db, full_api_url, delta):
         db.execute(stmt)
         db.commit()
     except Exception as e:
-        print(f"⚠️ 更新预订计数失败: {e}")
\ No newline at end of file
+        db.rollback()
+        log_error("TaskHelper", f"更新预订计数失败 ({full_api_url}, {delta:+d}): {e}")
\ No newline at end of file
@@ -5,13 +5,14 @@ import random
 from sqlalchemy import update
 from common.models import GeminiServiceNode
 from common.logger import debug_log
-from services.workers.core.dispatch.router import get_database_target_url
+from services.workers.core.dispatch.router import get_database_target_url, invalidate_node_cache
 from services.workers.core.data.task_state import update_node_load
 
 
 def atomic_claim_node(db, full_api_url):
     """
     🔥 原子抢占 (CAS): 尝试利用数据库行锁将 dispatched_tasks 从 0 改为 1
+    与同一事务里 get_database_target_url 写入的路由一起提交 / 回滚
     """
     try:
         if "/v1/" in full_api_url:
@@ -28,11 +29,15 @@ def atomic_claim_node(db, full_api_url):
             .values(dispatched_tasks=1)
         )
         result = db.execute(stmt)
-        db.commit()  # 立即提交锁死状态
+        if result.rowcount == 1:
+            db.commit()  # 立即提交锁死状态 (连同 router 里未提交的路由 UPSERT)
+            return True
 
-        return result.rowcount == 1
+        # 抢占失败：连路由写入一起回滚，下一轮读到的仍是真正的旧节点，is_node_changed 才判断得对
+        db.rollback()
+        return False
     except Exception as e:
-        debug_log(f"⚠️ 抢占节点报错: {e}", "ERROR")
+        debug_log("⚠️ 抢占节点报错: %s", "ERROR", e)
         db.rollback()
         return False
 
@@ -47,22 +52,20 @@ def acquire_node_with_retry(db, conversation_id,slot_id=0, max_retries=3):
         route_result = get_database_target_url(db, conversation_id, slot_id=slot_id)
 
         if not route_result or not route_result[0]:
-            if attempt == 0:
-                break  # 第一次就没有，直接放弃
-            time.sleep(0.2)
-            continue
+            break  # 没有空闲节点 (缓存已是最新或刚被刷新)，直接放弃，不再空转重试
 
         candidate_url, candidate_changed = route_result
 
         # 2. 原子抢占
         if atomic_claim_node(db, candidate_url):
             target_base_url = candidate_url.replace("/v1/chat/completions", "")
-            debug_log(f"✅ 成功锁定节点: {candidate_url} (Attempt {attempt + 1})", "REQUEST")
+            debug_log("✅ 成功锁定节点: %s (Attempt %d)", "REQUEST", candidate_url, attempt + 1)
             return candidate_url, candidate_changed, target_base_url
         else:
-            # 3. 抢占失败，随机退避
+            # 3. 抢占失败：缓存里的负载已过时，强制下一轮重新查库，再随机退避
+            invalidate_node_cache()
             wait_time = random.uniform(0.05, 0.15)
-            debug_log(f"🔄 节点被抢占，{wait_time:.2f}s 后重试 ({attempt + 1}/{max_retries})...", "INFO")
+            debug_log("🔄 节点被抢占，%.2fs 后重试 (%d/%d)...", "INFO", wait_time, attempt + 1, max_retries)
             time.sleep(wait_time)
 
     return None, None, None
@@ -75,6 +78,6 @@ def release_node_safe(db, node_url):
     if node_url:
         try:
             update_node_load(db, node_url, -1)
-            # debug_log(f"🔓 节点资源释放: {node_url}", "INFO")
+            # debug_log("🔓 节点资源释放: %s", "INFO", node_url)
         except Exception as e:
-            debug_log(f"⚠️ 释放节点失败: {e}", "ERROR")
\ No newline at end of file
+            debug_log("⚠️ 释放节点失败: %s", "ERROR", e)
\ No newline at end of file
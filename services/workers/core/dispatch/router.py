@@ -1,84 +1,181 @@
 import random
+import select as io_select
+import threading
+import time
 from datetime import datetime, timedelta
+from sqlalchemy import select, case, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from common import database
 from common.logger import debug_log
-from common.models import ConversationRoute, GeminiServiceNode
+from common.models import ConversationRoute, GeminiServiceNode, NodeStatus
+
+# 与 gateway 心跳巡检 (services/gateway/core/node_manager.py) 的 NOTIFY 频道保持一致
+NODE_OFFLINE_CHANNEL = "node_offline"
+
+# === 活跃节点进程内缓存 ===
+# 节点表很小且只随心跳节奏 (10~30s) 变化，没必要每个请求都查一次库。
+# 缓存的是纯数据行 (Row)，不绑定任何 Session；节点占用最终由 atomic_claim_node 的 CAS 兜底。
+NODE_CACHE_TTL = 1.0
+
+# Gemini 节点是独占式的 (atomic_claim_node 的 CAS 要求 dispatched_tasks == 0)，
+# 只有空闲节点 (dispatched + current == 0) 才能被选中或粘性复用；空闲判断在缓存列表上做，查询本身不带负载条件
+_NODE_CACHE = {"t": 0.0, "nodes": []}
+_NODE_LOCK = threading.Lock()
+_listener_started = False
+
+
+def invalidate_node_cache():
+    """强制下一次路由重新查库"""
+    with _NODE_LOCK:
+        _NODE_CACHE["t"] = 0.0
+
+
+def _listen_node_offline():
+    """
+    后台线程：LISTEN 节点下线频道，收到通知立即让缓存失效，
+    而不是等 TTL 自然过期。连接断开后退避重连。
+    """
+    while True:
+        raw_conn = None
+        try:
+            raw_conn = database.engine.raw_connection()
+            pg_conn = raw_conn.driver_connection
+            pg_conn.autocommit = True
+            cur = pg_conn.cursor()
+            cur.execute(f"LISTEN {NODE_OFFLINE_CHANNEL}")
+
+            while True:
+                if io_select.select([pg_conn], [], [], 60)[0]:
+                    pg_conn.poll()
+                    if pg_conn.notifies:
+                        pg_conn.notifies.clear()
+                        invalidate_node_cache()
+        except Exception as e:
+            debug_log("⚠️ 节点下线监听中断，5s 后重连: %s", "WARNING", e)
+            time.sleep(5)
+        finally:
+            if raw_conn is not None:
+                try:
+                    raw_conn.invalidate()
+                except Exception:
+                    pass
+
+
+def _ensure_listener():
+    global _listener_started
+    if _listener_started:
+        return
+    with _NODE_LOCK:
+        if _listener_started:
+            return
+        _listener_started = True
+    threading.Thread(target=_listen_node_offline, daemon=True).start()
+
+
+def _get_active_nodes(db):
+    """
+    返回当前可用节点列表 (带 TTL 缓存)。
+    只取路由需要的列，返回的 Row 与 Session 无关，可跨请求复用。
+    """
+    _ensure_listener()
+    with _NODE_LOCK:
+        if time.monotonic() - _NODE_CACHE["t"] < NODE_CACHE_TTL:
+            return _NODE_CACHE["nodes"]
+
+        alive_threshold = datetime.now() - timedelta(seconds=30)
+        nodes = db.query(
+            GeminiServiceNode.node_url,
+            GeminiServiceNode.dispatched_tasks,
+            GeminiServiceNode.current_tasks
+        ).filter(
+            GeminiServiceNode.last_heartbeat > alive_threshold,
+            GeminiServiceNode.status == NodeStatus.HEALTHY
+        ).all()
+
+        _NODE_CACHE["nodes"] = nodes
+        _NODE_CACHE["t"] = time.monotonic()
+        return nodes
+
+
+def _node_load(node):
+    return (node.dispatched_tasks or 0) + (node.current_tasks or 0)
 
 
 def get_database_target_url(db, conversation_id, slot_id=0):
     """
     🎯 基于数据库的服务发现逻辑 (分离存储版)
     直接读写 ConversationRoute 表，彻底解决 JSON 覆盖问题。
+    路由的读取与保存合并为一条 INSERT ... ON CONFLICT ... RETURNING，一次往返完成。
     """
     try:
-        # 1. 查活跃节点 (保持不变)
-        alive_threshold = datetime.now() - timedelta(seconds=30)
-        active_nodes = db.query(GeminiServiceNode).filter(
-            GeminiServiceNode.last_heartbeat > alive_threshold,
-            GeminiServiceNode.status == "HEALTHY",
-            GeminiServiceNode.dispatched_tasks == 0,
-            GeminiServiceNode.current_tasks == 0
-        ).all()
+        # 1. 查活跃节点 (走进程内缓存)
+        active_nodes = _get_active_nodes(db)
 
         if not active_nodes:
             debug_log("❌ 无可用健康节点", "ERROR")
             return None, False
 
-        healthy_map = {node.node_url: node for node in active_nodes}
-        target_url = None
+        # 先在缓存的节点列表里挑出空闲节点 (纯内存，无需查库)
+        # 全部繁忙时直接失败：不写路由、不去抢一个注定抢不到的节点
+        idle_nodes = [node for node in active_nodes if _node_load(node) == 0]
+        if not idle_nodes:
+            debug_log("⏳ 健康节点均繁忙 (%d 个)", "WARNING", len(active_nodes))
+            return None, False
+
+        # 随机打散，避免多个 Worker 同时扑向同一个节点
+        target_url = random.choice(idle_nodes).node_url
+        idle_urls = [node.node_url for node in idle_nodes]
+        is_node_changed = False
 
         # =========================================================
-        # 🔥 2. 会话粘性 (直接查 ConversationRoute 表)
+        # 🔥 2. 会话粘性 + 保存 (一条 UPSERT 搞定 ConversationRoute)
         # =========================================================
-        route_record = None
+        # 旧节点仍健康空闲 -> 保留旧节点 (粘性复用)；否则改写为候选节点。
+        # 只读写自己槽位的那一行，绝对不会碰到别人的 Slot 数据！
         if conversation_id:
-            # 只查自己槽位的那一行，绝对不会读到别人的 Slot 数据！
-            route_record = db.query(ConversationRoute).get((conversation_id, slot_id))
+            route_key = (
+                (ConversationRoute.conversation_id == conversation_id)
+                & (ConversationRoute.slot_id == slot_id)
+            )
+            # RETURNING 里的子查询与 UPSERT 共用同一快照，读到的是本次写入之前的旧值
+            old_url = select(ConversationRoute.node_url).where(route_key).scalar_subquery()
 
-            if route_record:
-                last_node_url = route_record.node_url
+            stmt = pg_insert(ConversationRoute).values(
+                conversation_id=conversation_id,
+                slot_id=slot_id,
+                node_url=target_url
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ConversationRoute.conversation_id, ConversationRoute.slot_id],
+                set_={
+                    "node_url": case(
+                        (ConversationRoute.node_url.in_(idle_urls), ConversationRoute.node_url),
+                        else_=stmt.excluded.node_url
+                    ),
+                    "updated_at": func.now()
+                }
+            ).returning(ConversationRoute.node_url, old_url.label("old_url"))
 
-                # 检查节点是否存活且空闲
-                if last_node_url and last_node_url in healthy_map:
-                    candidate = healthy_map[last_node_url]
-                    if candidate.dispatched_tasks == 0 and candidate.current_tasks == 0:
-                        target_url = last_node_url
-                        debug_log(f"🔗 [槽位 {slot_id}] 复用节点: {target_url}", "INFO")
+            # 注意：这里我们不立即 commit，而是交给外层 node_manager 统一 commit
+            # 这样可以保证 节点锁定 + 路由保存 是一个原子操作
+            row = db.execute(stmt).one()
+            target_url = row.node_url
 
-        # =========================================================
-        # 🔥 3. 负载均衡 & 保存 (直接写 ConversationRoute 表)
-        # =========================================================
-        if not target_url:
-            chosen_node = random.choice(active_nodes)
-            target_url = chosen_node.node_url
-            debug_log(f"🎲 [槽位 {slot_id}] 新分配: {target_url}", "INFO")
-
-            if conversation_id:
-                if route_record:
-                    # 如果记录存在，更新它
-                    route_record.node_url = target_url
-                    # db.add(route_record) # 对象在 session 里，会自动 commit
-                else:
-                    # 如果记录不存在，创建新行
-                    new_route = ConversationRoute(
-                        conversation_id=conversation_id,
-                        slot_id=slot_id,
-                        node_url=target_url
-                    )
-                    db.add(new_route)
-
-                # 注意：这里我们不立即 commit，而是交给外层 node_manager 统一 commit
-                # 这样可以保证 节点锁定 + 路由保存 是一个原子操作
-
-        # 判断是否变更
-        is_node_changed = False
-        if route_record and route_record.node_url != target_url:
-            is_node_changed = True
-        elif not route_record:
-            is_node_changed = False  # 第一次不算变更，或者你可以算 True
+            # 没有旧路由也按变更处理：路由可能随节点下线被心跳巡检清理了，新节点需要同步历史；
+            # 真正的新会话没有历史，build_conversation_context 只会返回当前问题
+            is_node_changed = row.old_url != target_url
+
+            if row.old_url == target_url:
+                debug_log("🔗 [槽位 %s] 复用节点: %s", "INFO", slot_id, target_url)
+            else:
+                debug_log("🎲 [槽位 %s] 新分配: %s", "INFO", slot_id, target_url)
+        else:
+            debug_log("🎲 [槽位 %s] 新分配: %s", "INFO", slot_id, target_url)
 
         final_url = f"{target_url}/v1/chat/completions"
         return final_url, is_node_changed
 
     except Exception as e:
-        debug_log(f"❌ 路由异常: {e}", "ERROR")
+        debug_log("❌ 路由异常: %s", "ERROR", e)
         return None, False
\ No newline at end of file
@@ -0,0 +1,78 @@
+import os
+
+import httpx
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 进程级共享的 HTTP 会话：keep-alive 连接在任务之间复用，省掉每个任务的 TCP (/TLS) 握手
+# Retry 只对连接失败、以及幂等方法的 502/503/504 生效；POST 生成请求不会因状态码被重放
+_retry = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=_retry)
+# 建连超时 (秒)，与读超时分开传 (timeout=(CONNECT_TIMEOUT, 读超时))：
+# 连接失败会被上面的 Retry 重试，若共用一个长超时，一个不可达节点就能把一条消息拖到 3 × 读超时
+CONNECT_TIMEOUT = 5
+
+http_session = requests.Session()
+http_session.mount("http://", _adapter)
+http_session.mount("https://", _adapter)
+
+# 下游 JSON 请求头：模块级常量，调用方不必每个任务新建一个 dict
+# (不挂到 http_session.headers 上，否则上传文件时会盖掉 multipart 的 Content-Type)
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# HTTP/2 客户端 (LLM_HTTP2=true 时启用，仅用于 LLM 对话请求)
+# 下游支持 h2 时，同一进程的所有在途请求复用一条连接上的多路流；
+# 协议靠 TLS ALPN 协商，http:// 明文节点或不支持 h2 的服务会自动回落到 HTTP/1.1
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "false").lower() in ("1", "true", "yes")
+llm_h2_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=16)
+) if LLM_HTTP2 else None
+
+
+def post_llm(url, body, timeout):
+    """
+    🚀 发送 LLM 对话请求 (body 为已序列化的 JSON bytes)
+    开启 LLM_HTTP2 时走 httpx 的 HTTP/2 客户端，否则走共享的 requests 会话 (stream=True，按需读取 body)
+    :param timeout: 读超时 (秒)；建连统一用 CONNECT_TIMEOUT
+    """
+    if llm_h2_client is not None:
+        return llm_h2_client.post(
+            url, content=body, headers=JSON_HEADERS, timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT)
+        )
+    return http_session.post(url, data=body, headers=JSON_HEADERS, timeout=(CONNECT_TIMEOUT, timeout), stream=True)
+
+
+def read_error_preview(response, limit=512):
+    """
+    读取错误响应体的前 limit 字节用于日志 (requests 请求需带 stream=True)
+    不把整个错误页拉下来再整体解码；读完即关闭响应，剩余 body 直接丢弃
+    """
+    if isinstance(response, httpx.Response):
+        # httpx 非流式响应 body 已经读完，只截取前缀解码
+        return response.content[:limit].decode("utf-8", errors="replace")
+
+    try:
+        chunk = response.raw.read(limit, decode_content=True) or b""
+    except Exception:
+        chunk = b""
+    finally:
+        response.close()
+    return chunk.decode("utf-8", errors="replace")
+
+
+def extract_reply_text(body):
+    """
+    从下游响应体 (bytes) 取出回复文本：orjson 一次解析，按已知路径直接取值
+    OpenAI 格式 choices[0].message.content 优先，其次自定义服务的 response 字段，都没有时整体转字符串
+    """
+    res_json = orjson.loads(body)
+    try:
+        return res_json["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        pass
+    if isinstance(res_json, dict) and "response" in res_json:
+        return res_json["response"]
+    return str(res_json)
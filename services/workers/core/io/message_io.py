@@ -1,6 +1,7 @@
-import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+import orjson
 import redis
 
 from common.logger import debug_log
@@ -10,35 +11,73 @@ from common.models import TaskStatus
 
 DLQ_STREAM_KEY = "sys_dead_letters"
 
-def send_to_dlq(redis_client, message_id, raw_payload, error_msg, source="Unknown"):
+def send_to_dlq(redis_client, message_id, raw_payload, error_msg, source="Unknown", pipe=None):
     """
     💀 将烂消息移入死信队列，并 ACK 丢弃
+    :param pipe: 可选的 Redis pipeline；传入时只把 XADD 挂到 pipeline 上，由调用方统一 execute
     """
     try:
-        # 确保 message_id 是字符串
-        if isinstance(message_id, bytes):
-            message_id = message_id.decode()
-
-        # 确保 payload 是字符串
-        payload_str = "None"
-        if raw_payload:
-            payload_str = raw_payload.decode('utf-8', errors='ignore') if isinstance(raw_payload, bytes) else str(
-                raw_payload)
-
+        # Redis 字段值直接收 bytes：原始 ID 和 payload 原样写入死信，不做解码/重编码 (也不会丢掉非法字节)
         dead_msg = {
             "original_id": message_id,
             "error": str(error_msg),
             "source_worker": source,
             "failed_at": str(int(time.time())),
-            "raw_payload": payload_str
+            "raw_payload": raw_payload if raw_payload else "None"
         }
 
         # 1. 入死信
-        redis_client.xadd(DLQ_STREAM_KEY, dead_msg, maxlen=10000)
-        debug_log(f"💀 已移入死信队列: {message_id}", "WARNING")
+        if pipe is not None:
+            pipe.xadd(DLQ_STREAM_KEY, dead_msg, maxlen=10000)
+        else:
+            redis_client.xadd(DLQ_STREAM_KEY, dead_msg, maxlen=10000)
+        debug_log("💀 已移入死信队列: %s", "WARNING", message_id)
 
     except Exception as e:
-        debug_log(f"写入死信队列失败: {e}", "ERROR")
+        debug_log("写入死信队列失败: %s", "ERROR", e)
+
+def ack_message(redis_client, stream_key, group_name, message_id, ack_buffer=None):
+    """
+    ✅ ACK 一条消息
+    传入 ack_buffer 时只记账，由批次结束时的 flush_acks 统一提交；否则立即 XACK
+    """
+    if ack_buffer is not None:
+        ack_buffer.append(message_id)
+    else:
+        redis_client.xack(stream_key, group_name, message_id)
+
+
+def flush_acks(redis_client, stream_key, group_name, ack_buffer):
+    """批量提交 ACK：XACK 支持多个 ID，一批消息只需一次往返"""
+    if ack_buffer:
+        redis_client.xack(stream_key, group_name, *ack_buffer)
+        ack_buffer.clear()
+
+
+def process_batch(executor, messages, process_callback, **callback_kwargs):
+    """
+    ⚡ 并发处理一批消息，等待整批完成后返回
+    下游是纯 I/O 等待 (LLM 推理)，线程池让同一进程内多个请求同时在途；
+    每个回调自带 Session，ack_buffer 等共享参数只做 list.append (线程安全)
+    """
+    futures = [
+        executor.submit(process_callback, message_id, message_data, **callback_kwargs)
+        for message_id, message_data in messages
+    ]
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            debug_log("消息处理异常: %s", "ERROR", e)
+
+
+def _dead_letter_and_ack(redis_client, stream_key, group_name, message_id, raw_payload, error_msg, source):
+    """死信 XADD + 原队列 XACK 走同一个 pipeline，一次网络往返"""
+    pipe = redis_client.pipeline(transaction=False)
+    send_to_dlq(redis_client, message_id, raw_payload, error_msg, source, pipe=pipe)
+    pipe.xack(stream_key, group_name, message_id)
+    pipe.execute()
+
 
 def parse_and_validate(redis_client, stream_key, group_name, message_id, message_data, consumer_name):
     """
@@ -50,29 +89,135 @@ def parse_and_validate(redis_client, stream_key, group_name, message_id, message
 
     # 1. 检查空消息
     if not payload_bytes:
-        send_to_dlq(redis_client, message_id, b"", "Empty Payload", consumer_name)
-        redis_client.xack(stream_key, group_name, message_id)
+        _dead_letter_and_ack(redis_client, stream_key, group_name, message_id, b"", "Empty Payload", consumer_name)
         return None
 
     try:
-        # 2. 尝试解析 JSON
-        task_data = json.loads(payload_bytes)
+        # 2. 尝试解析 JSON (orjson 直接吃 bytes，省一次 decode)
+        task_data = orjson.loads(payload_bytes)
         return task_data
 
-    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+    except (orjson.JSONDecodeError, UnicodeDecodeError) as e:
         # 3. 解析失败 -> 自动处理后事 (DLQ + ACK)
-        debug_log(f"数据解析失败: {e}", "ERROR")
-        send_to_dlq(redis_client, message_id, payload_bytes, f"JSON Error: {e}", consumer_name)
-        redis_client.xack(stream_key, group_name, message_id)
+        debug_log("数据解析失败: %s", "ERROR", e)
+        _dead_letter_and_ack(
+            redis_client, stream_key, group_name, message_id, payload_bytes, f"JSON Error: {e}", consumer_name
+        )
         return None
 
+def _recover_messages(redis_client, stream_key, group_name, consumer_name, messages, process_callback,
+                     executor, expire_ms=60000):
+    """
+    ♻️ 恢复一批挂起消息，分三个阶段：
+    1. 分类 (纯 CPU)：解析时间戳与 payload，区分过期消息和待恢复消息
+    2. 批量落库/ACK：一次查询任务状态 + 一条 UPDATE 修复僵尸任务，过期/已完成消息一次 XACK
+    3. 并发回调：待恢复消息交给线程池并发执行 Worker 逻辑 (每个回调自带 Session，互不共享)，ACK 攒到最后一次提交
+
+    :param expire_ms: 消息年龄超过该值直接丢弃 (即时聊天的容忍度)；None 表示不丢弃
+    """
+    # --- 1. 预扫描：丢弃过期消息，解析出每条消息的 task_id ---
+    live_messages = []
+    expired_ids = []
+    for message_id, message_data in messages:
+        task_id = None
+        try:
+            if expire_ms is not None:
+                # Redis 的 message_id (如 "1678888888888-0") 前半部分是时间戳(毫秒)
+                msg_timestamp = int(message_id.split(b'-', 1)[0])
+                current_time = int(time.time() * 1000)
+
+                # 如果消息超过 expire_ms，直接丢弃
+                if current_time - msg_timestamp > expire_ms:
+                    debug_log("⏰ 丢弃过期任务: %s (超时 > %ds)", "WARNING", message_id, expire_ms // 1000)
+                    expired_ids.append(message_id)
+                    continue  # 跳过，不执行
+
+            payload_bytes = message_data.get(b'payload')
+            if payload_bytes:
+                task_id = orjson.loads(payload_bytes).get('task_id')
+
+        except Exception as e:
+            debug_log("预检查解析失败 (将由 Worker 自动处理): %s", "WARNING", e)
+            # 解析都失败了，交给 parse_and_validate 统一走死信流程
+
+        live_messages.append((message_id, message_data, task_id))
+
+    # --- 2. 一次性查出所有任务状态，批量修复僵尸任务 ---
+    task_status = {}
+    task_ids = [task_id for _, _, task_id in live_messages if task_id]
+    if task_ids:
+        db = SessionLocal()
+        try:
+            rows = db.query(models.Task.task_id, models.Task.status).filter(
+                models.Task.task_id.in_(task_ids)
+            ).all()
+            task_status = {row.task_id: row.status for row in rows}
+
+            # 🔥 关键修复：如果任务状态是 PROCESSING，说明是上次崩溃留下的
+            # 必须强制重置为 PENDING，否则后续 claim_task 会抢占失败
+            zombie_task_ids = [
+                task_id for task_id, status in task_status.items()
+                if status == TaskStatus.PROCESSING
+            ]
+            if zombie_task_ids:
+                result = db.query(models.Task).filter(
+                    models.Task.task_id.in_(zombie_task_ids),
+                    models.Task.status == TaskStatus.PROCESSING
+                ).update(
+                    {"status": TaskStatus.PENDING},
+                    synchronize_session=False
+                )
+                db.commit()
+                debug_log("🔧 [自愈] 修复僵尸任务 %s 个: PROCESSING -> PENDING", "INFO", result)
+        except Exception as e:
+            db.rollback()
+            task_status = {}
+            debug_log("批量修复僵尸任务失败: %s", "WARNING", e)
+        finally:
+            db.close()
+
+    # 已经 SUCCESS/FAILED 只是没来得及 ACK 的消息，无需再走 Worker 逻辑，和过期消息一起 ACK
+    settled_ids = [
+        message_id for message_id, _, task_id in live_messages
+        if task_status.get(task_id) in (TaskStatus.SUCCESS, TaskStatus.FAILED)
+    ]
+    ack_ids = expired_ids + settled_ids
+    if ack_ids:
+        # XACK 支持多个 ID，一次往返
+        redis_client.xack(stream_key, group_name, *ack_ids)
+
+    # --- 3. 调用具体的 Worker 逻辑进行处理 ---
+    # check_idempotency=True 依然重要，防止处理那些状态未知 (查询失败/任务缺失) 的消息被重复执行
+    settled = set(settled_ids)
+    pending_items = [
+        (message_id, message_data) for message_id, message_data, _ in live_messages
+        if message_id not in settled
+    ]
+    if pending_items:
+        # 恢复批次同样只记账，整批结束后一次 XACK，而不是每条消息各自一次往返
+        ack_buffer = []
+        try:
+            process_batch(
+                executor, pending_items, process_callback,
+                check_idempotency=True, ack_buffer=ack_buffer
+            )
+        finally:
+            flush_acks(redis_client, stream_key, group_name, ack_buffer)
+
+
 def recover_pending_tasks(
         redis_client: redis.Redis,
         stream_key: str,
         group_name: str,
         consumer_name: str,
-        process_callback
+        process_callback,
+        max_workers: int = 4
 ):
+    """
+    ♻️ 启动时恢复本消费者 PEL 中的挂起消息 (流程见 _recover_messages)
+
+    :param max_workers: 回调并发数
+    """
     try:
         # 获取所有已认领但未 ACK 的消息 (Start from '0')
         response = redis_client.xreadgroup(
@@ -82,58 +227,56 @@ def recover_pending_tasks(
         if response:
             stream_name, messages = response[0]
             if messages:
-                debug_log(f"♻️  [{consumer_name}] 正在恢复 {len(messages)} 个挂起任务...", "WARNING")
-
-                # 获取数据库会话，用于批量修复状态
-                db = SessionLocal()
-
-                try:
-                    for message_id, message_data in messages:
-                        # --- 1. 尝试解析并修复僵尸状态 ---
-                        try:
-                            # Redis 的 message_id (如 "1678888888888-0") 前半部分是时间戳(毫秒)
-                            msg_timestamp = int(message_id.decode().split('-')[0])
-                            current_time = int(time.time() * 1000)
-
-                            # 如果消息超过 60 秒（即时聊天的容忍度），直接丢弃
-                            if current_time - msg_timestamp > 60000:
-                                print(f"⏰ 丢弃过期任务: {message_id} (超时 > 60s)")
-                                redis_client.xack(stream_key, group_name, message_id)
-                                continue  # 跳过，不执行
-
-                            payload_bytes = message_data.get(b'payload')
-                            if payload_bytes:
-                                task_data = json.loads(payload_bytes)
-                                task_id = task_data.get('task_id')
-
-                                # 🔥 关键修复：如果任务状态是 PROCESSING，说明是上次崩溃留下的
-                                # 必须强制重置为 PENDING，否则后续 claim_task 会抢占失败
-                                if task_id:
-                                    result = db.query(models.Task).filter(
-                                        models.Task.task_id == task_id,
-                                        models.Task.status == TaskStatus.PROCESSING
-                                    ).update(
-                                        {"status": TaskStatus.PENDING},
-                                        synchronize_session=False
-                                    )
-                                    if result > 0:
-                                        db.commit()
-                                        debug_log(f"🔧 [自愈] 修复僵尸任务: {task_id} PROCESSING -> PENDING", "INFO")
-
-                        except Exception as e:
-                            debug_log(f"预检查解析失败 (将由 Worker 自动处理): {e}", "WARNING")
-                            # 解析都失败了，通常建议直接 ACK 跳过，防止死循环
-                            # redis_client.xack(stream_key, group_name, message_id)
-                            # continue
-
-                        # --- 2. 调用具体的 Worker 逻辑进行处理 ---
-                        # check_idempotency=True 依然重要，防止处理那些其实已经 SUCCESS 但没 ACK 的任务
-                        process_callback(message_id, message_data, check_idempotency=True)
-
-                finally:
-                    db.close()
-
+                debug_log("♻️  [%s] 正在恢复 %s 个挂起任务...", "WARNING", consumer_name, len(messages))
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    _recover_messages(
+                        redis_client, stream_key, group_name, consumer_name,
+                        messages, process_callback, executor
+                    )
                 debug_log("✅ 挂起任务处理完毕", "INFO")
 
     except Exception as e:
-        debug_log(f"❌ 恢复 Pending 任务流程失败: {e}", "ERROR")
+        debug_log("❌ 恢复 Pending 任务流程失败: %s", "ERROR", e)
+
+
+def claim_stalled_messages(
+        redis_client: redis.Redis,
+        stream_key: str,
+        group_name: str,
+        consumer_name: str,
+        process_callback,
+        executor,
+        min_idle_ms: int,
+        count: int = 100
+):
+    """
+    🪝 XAUTOCLAIM：把组内任意消费者名下闲置超过 min_idle_ms 的消息转到自己名下并处理
+    挂掉的 Worker 留下的消息不会再永远卡在它的 PEL 里
+
+    min_idle_ms 必须大于单条消息的最长处理时间 (请求超时 + 余量)，否则会抢走别人正在处理的消息。
+    认领来的消息闲置时间本来就很长，不再按消息年龄丢弃，直接走恢复流程。
+    """
+    start_id = "0-0"
+    try:
+        while True:
+            response = redis_client.xautoclaim(
+                stream_key, group_name, consumer_name, min_idle_ms, start_id=start_id, count=count
+            )
+            next_id, messages = response[0], response[1]
+            # 已被 XDEL 的条目 Redis 会直接从 PEL 里清掉，这里只处理还有内容的
+            messages = [(message_id, message_data) for message_id, message_data in messages if message_data]
+
+            if messages:
+                debug_log("🪝 [%s] 认领 %s 条闲置消息", "WARNING", consumer_name, len(messages))
+                _recover_messages(
+                    redis_client, stream_key, group_name, consumer_name,
+                    messages, process_callback, executor, expire_ms=None
+                )
+
+            # 游标回到 0-0 说明整个 PEL 扫完了
+            if next_id in (b"0-0", "0-0"):
+                break
+            start_id = next_id
+
+    except Exception as e:
+        debug_log("❌ 认领闲置消息失败: %s", "ERROR", e)
@@ -1,6 +1,8 @@
 import os
-import requests
+
+import orjson
 from common.logger import debug_log
+from services.workers.core.io.http_client import http_session, CONNECT_TIMEOUT
 
 
 def upload_files_to_downstream(target_base_url, local_file_paths):
@@ -25,24 +27,24 @@ def upload_files_to_downstream(target_base_url, local_file_paths):
                 # ('files', (filename, file_object, content_type))
                 files_to_send.append(('files', (os.path.basename(path), f, 'application/octet-stream')))
             else:
-                debug_log(f"⚠️ 文件不存在，跳过: {path}", "WARNING")
+                debug_log("⚠️ 文件不存在，跳过: %s", "WARNING", path)
 
         if not files_to_send:
             return []
 
         # 2. 发送上传请求
-        debug_log(f"正在上传文件到下游: {upload_url}", "REQUEST")
-        resp = requests.post(upload_url, files=files_to_send, timeout=60)
+        debug_log("正在上传文件到下游: %s", "REQUEST", upload_url)
+        resp = http_session.post(upload_url, files=files_to_send, timeout=(CONNECT_TIMEOUT, 60))
 
         if resp.status_code == 200:
-            data = resp.json()
+            data = orjson.loads(resp.content)
             remote_files = data.get("files", [])
-            debug_log(f"✅ 文件中转成功: {remote_files}", "SUCCESS")
+            debug_log("✅ 文件中转成功: %s", "SUCCESS", remote_files)
         else:
-            debug_log(f"❌ 文件上传失败: {resp.text}", "ERROR")
+            debug_log("❌ 文件上传失败: %s", "ERROR", resp.text)
 
     except Exception as e:
-        debug_log(f"❌ 上传过程异常: {e}", "ERROR")
+        debug_log("❌ 上传过程异常: %s", "ERROR", e)
     finally:
         # 关闭所有文件句柄
         for f in opened_files:
@@ -0,0 +1,114 @@
+import os
+import re
+import time
+import socket
+import multiprocessing
+
+from common.logger import debug_log
+
+# 子进程序号通过环境变量传给 spawn 出来的进程 (子进程会重新导入 Worker 模块，模块级的 CONSUMER_NAME 据此生成)
+PROCESS_INDEX_ENV = "WORKER_PROCESS_INDEX"
+# 子进程意外退出后，隔多久再拉起
+RESTART_DELAY = 1
+# 是否把每个 Worker 进程钉在一个 CPU 核上 (仅 Linux 生效)
+CPU_AFFINITY = os.getenv("WORKER_CPU_AFFINITY", "false").lower() in ("1", "true", "yes")
+
+
+def resolve_process_count(value):
+    """
+    解析进程数配置
+    "auto" / "0" -> CPU 核数；其它按整数处理，至少 1 个
+    """
+    if str(value).strip().lower() in ("auto", "0"):
+        return os.cpu_count() or 1
+    return max(1, int(value))
+
+
+def default_worker_identity(prefix=None):
+    """
+    未配置 *_WORKER_ID 时的默认身份
+    多进程模式下只用主机名 (进程序号由 consumer_name_for_process 追加)，子进程重启后身份不变；
+    单进程模式再加上 pid，区分同一主机上手动起的多个实例
+    """
+    base = f"{prefix}-{socket.gethostname()}" if prefix else socket.gethostname()
+    if os.getenv(PROCESS_INDEX_ENV) is not None:
+        return base
+    return f"{base}-{os.getpid()}"
+
+
+def consumer_name_for_process(base_name):
+    """
+    多进程模式下给消费者名加上进程序号后缀
+    序号固定 (而不是 pid)：只要 base_name 本身不含 pid (配置了 *_WORKER_ID，或用 default_worker_identity 生成)，
+    子进程重启后沿用同一个名字，能接着恢复自己名下的 Pending 消息
+    """
+    index = os.getenv(PROCESS_INDEX_ENV)
+    return f"{base_name}-p{index}" if index is not None else base_name
+
+
+def pin_worker_cpu(worker_id=None):
+    """
+    📌 把当前进程钉到一个 CPU 核上，减少跨核迁移，JSON 解析 / ORM 路径的 L1/L2 缓存保持热
+    核号取进程序号 (多进程模式)，否则取 worker_id 末尾的数字 (如 gemini-worker-2)，对可用核数取模。
+    WORKER_CPU_AFFINITY 未开启或平台不支持 (非 Linux) 时什么都不做。
+    须在创建线程池之前调用，之后创建的线程才会继承该亲和性。
+    """
+    if not CPU_AFFINITY or not hasattr(os, "sched_setaffinity"):
+        return
+
+    index = os.getenv(PROCESS_INDEX_ENV)
+    if index is None:
+        match = re.search(r"(\d+)$", worker_id or "")
+        index = match.group(1) if match else 0
+
+    # 在容器 cpuset 允许的核里选，而不是 0..cpu_count
+    cpus = sorted(os.sched_getaffinity(0))
+    core = cpus[int(index) % len(cpus)]
+    try:
+        os.sched_setaffinity(0, {core})
+        debug_log("📌 Worker 已绑定 CPU %s", "INFO", core)
+    except OSError as e:
+        debug_log("⚠️ 绑定 CPU 失败: %s", "WARNING", e)
+
+
+def _spawn(ctx, target, index):
+    os.environ[PROCESS_INDEX_ENV] = str(index)
+    try:
+        proc = ctx.Process(target=target, name=f"worker-p{index}")
+        proc.start()
+    finally:
+        os.environ.pop(PROCESS_INDEX_ENV, None)
+    return proc
+
+
+def run_worker_processes(target, num_processes):
+    """
+    🧩 多进程扇出：同一主机起 N 个消费者进程，各自拥有独立的 GIL、数据库连接池和 Redis 连接
+    消费者组本身保证一条消息只投递给一个消费者，进程之间无需额外协调
+
+    :param target: 子进程入口 (通常是各 Worker 的 start_worker)
+    :param num_processes: 进程数，1 时直接在当前进程运行
+    """
+    if num_processes <= 1:
+        target()
+        return
+
+    # 用 spawn 而不是 fork：子进程重新导入模块，不会继承父进程的连接池、日志线程等状态
+    ctx = multiprocessing.get_context("spawn")
+    procs = {index: _spawn(ctx, target, index) for index in range(num_processes)}
+    debug_log("🧩 已启动 %s 个 Worker 进程", "INFO", num_processes)
+
+    try:
+        while True:
+            for index, proc in list(procs.items()):
+                proc.join(timeout=RESTART_DELAY)
+                if proc.exitcode is not None:
+                    debug_log("⚠️ Worker 进程 p%s 退出 (exitcode=%s)，重新拉起", "WARNING", index, proc.exitcode)
+                    time.sleep(RESTART_DELAY)
+                    procs[index] = _spawn(ctx, target, index)
+    except KeyboardInterrupt:
+        debug_log("🛑 收到退出信号，停止所有 Worker 进程", "INFO")
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            proc.join()
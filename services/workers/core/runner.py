@@ -1,17 +1,25 @@
 import time
-import requests
+
+import httpx
+import orjson
 from requests.exceptions import RequestException, Timeout, ConnectTimeout
 from common import database
 from common.logger import debug_log
 from . import (
     parse_and_validate,
+    ack_message,
+    defer_task_success,
     claim_task,
     mark_task_failed,
     upload_files_to_downstream,
     build_conversation_context,
-    process_ai_result,
+    reject_refusal,
+    finish_task_success,
     acquire_node_with_retry,
-    release_node_safe
+    release_node_safe,
+    post_llm,
+    read_error_preview,
+    extract_reply_text
 )
 
 def run_chat_task(
@@ -23,14 +31,18 @@ def run_chat_task(
         message_data,
         check_idempotency=True,
         refusal_keywords=None,
-        request_timeout=120
+        request_timeout=120,
+        ack_buffer=None,
+        defer_results=False
 ):
     """
     🚀 通用 AI 对话任务执行器
     封装了：解析 -> 幂等 -> 抢节点 -> 上传 -> 上下文 -> 请求 -> 保存 -> 异常 -> 释放
+    :param ack_buffer: 批量消费时传入，ACK 记入其中由调用方统一提交
+    :param defer_results: 为 True 时成功结果交给后台写入线程落库，提交后再 ACK，处理线程不等数据库
     """
     node_url_for_release = None
-    db = database.SessionLocal()
+    db = database.WorkerSession()
 
     # 1. 解析消息
     task_data = parse_and_validate(
@@ -51,10 +63,10 @@ def run_chat_task(
         # 2. 幂等性检查
         if check_idempotency:
             if not claim_task(db, task_id):
-                redis_client.xack(stream_key, group_name, message_id)
+                ack_message(redis_client, stream_key, group_name, message_id, ack_buffer)
                 return
 
-        debug_log(f"开始处理: {task_id} (Slot: {slot_id})", "REQUEST")
+        debug_log("开始处理: %s (Slot: %s)", "REQUEST", task_id, slot_id)
 
         # 3. 获取并锁定节点 (Core Logic)
         target_url, is_node_changed, target_base_url = acquire_node_with_retry(
@@ -63,9 +75,9 @@ def run_chat_task(
 
         if not target_url:
             error_msg = "系统繁忙：无可用节点或资源竞争超时"
-            debug_log(f"❌ {error_msg}", "ERROR")
+            debug_log("❌ %s", "ERROR", error_msg)
             mark_task_failed(db, task_id, error_msg)
-            redis_client.xack(stream_key, group_name, message_id)
+            ack_message(redis_client, stream_key, group_name, message_id, ack_buffer)
             return
 
         db.expire_all()
@@ -83,7 +95,7 @@ def run_chat_task(
         # 5. 构建上下文
         messages_payload = []
         if is_node_changed:
-            debug_log(f"🔄 节点变更，同步历史记录...", "INFO")
+            debug_log("🔄 节点变更，同步历史记录...", "INFO")
             messages_payload = build_conversation_context(db, conversation_id, prompt)
         else:
             messages_payload = [{"role": "user", "content": prompt}]
@@ -96,42 +108,40 @@ def run_chat_task(
             "files": remote_file_paths if remote_file_paths else None
         }
 
-        start_time = time.time()
-        response = requests.post(
-            target_url,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=request_timeout
-        )
+        start_time = time.monotonic()
+        response = post_llm(target_url, orjson.dumps(payload), timeout=request_timeout)
 
         # 7. 处理结果
         if response.status_code == 200:
-            res_json = response.json()
-            try:
-                ai_text = res_json['choices'][0]['message']['content']
-            except (KeyError, IndexError, TypeError):
-                ai_text = str(res_json)
-
-            cost_time = round(time.time() - start_time, 2)
-
-            process_ai_result(
-                db, task_id, ai_text, cost_time, conversation_id,
-                refusal_keywords=refusal_keywords
-            )
-            redis_client.xack(stream_key, group_name, message_id)
+            ai_text = extract_reply_text(response.content)
+
+            cost_time = round(time.monotonic() - start_time, 2)
+
+            if reject_refusal(db, task_id, ai_text, refusal_keywords):
+                ack_message(redis_client, stream_key, group_name, message_id, ack_buffer)
+            elif defer_results:
+                # 成功结果交给后台写入线程：提交之后再 ACK
+                defer_task_success(
+                    redis_client, stream_key, group_name, message_id,
+                    task_id, ai_text, cost_time, conversation_id
+                )
+            else:
+                finish_task_success(db, task_id, ai_text, cost_time, conversation_id)
+                ack_message(redis_client, stream_key, group_name, message_id, ack_buffer)
         else:
-            raise RuntimeError(f"API Error {response.status_code}: {response.text[:100]}")
+            raise RuntimeError(f"API Error {response.status_code}: {read_error_preview(response, 100)}")
 
     # --- 统一异常处理 ---
-    except ConnectTimeout:
+    # (httpx 的异常对应 LLM_HTTP2 模式)
+    except (ConnectTimeout, httpx.ConnectTimeout):
         mark_task_failed(db, task_id, "无法连接到 AI 服务 (ConnectTimeout)")
-        redis_client.xack(stream_key, group_name, message_id)
-    except Timeout:
+        ack_message(redis_client, stream_key, group_name, message_id, ack_buffer)
+    except (Timeout, httpx.TimeoutException):
         mark_task_failed(db, task_id, "AI 生成超时 (Timeout)")
-        redis_client.xack(stream_key, group_name, message_id)
-    except RequestException as e:
+        ack_message(redis_client, stream_key, group_name, message_id, ack_buffer)
+    except (RequestException, httpx.HTTPError) as e:
         mark_task_failed(db, task_id, f"网络请求异常: {str(e)}")
-        redis_client.xack(stream_key, group_name, message_id)
+        ack_message(redis_client, stream_key, group_name, message_id, ack_buffer)
     except Exception as e:
         if "多模态文件上传失败" in str(e):
             mark_task_failed(db, task_id, "文件上传失败，无法处理请求")
@@ -139,12 +149,13 @@ def run_chat_task(
             mark_task_failed(db, task_id, str(e))
         else:
             db.rollback()
-            debug_log(f"Worker 内部崩溃: {e}", "ERROR")
+            debug_log("Worker 内部崩溃: %s", "ERROR", e)
             mark_task_failed(db, task_id, "系统内部处理错误")
 
-        redis_client.xack(stream_key, group_name, message_id)
+        ack_message(redis_client, stream_key, group_name, message_id, ack_buffer)
 
     finally:
         # 8. 统一释放节点
         release_node_safe(db, node_url_for_release)
+        # 归还连接、清空 identity map；Session 对象本身留在线程里复用
         db.close()
\ No newline at end of file
@@ -1,14 +1,15 @@
 # workers/gemini/gemini_worker.py
 import os
-import time
-import socket
 from pathlib import Path
 
 import redis
 
 from dotenv import load_dotenv
 from common.logger import debug_log
-from services.workers.core import recover_pending_tasks
+from services.workers.core import (
+    run_consumer_loop,
+    run_worker_processes, consumer_name_for_process, default_worker_identity, resolve_process_count, pin_worker_cpu
+)
 from services.workers.core.runner import run_chat_task
 
 # --- 1. 环境配置与加载 ---
@@ -29,13 +30,19 @@ REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 DEBUG = True
 STREAM_KEY = os.getenv("STREAM_KEY", "gemini_stream")
 GROUP_NAME = os.getenv("GROUP_NAME", "gemini_workers_group")
+# 单次 LLM 请求超时 (秒)
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", 120))
+# 并发数 / 批量读取 / XAUTOCLAIM 等消费配置在 services/workers/core/consumer.py，各 Worker 共用同一组环境变量
+# 本机起几个消费者进程 ("auto" = CPU 核数)，绕开 GIL；消费者组保证同一条消息只投递给其中一个
+WORKER_PROCESSES = resolve_process_count(os.getenv("WORKER_PROCESSES", 1))
 
 # Worker 身份标识
 worker_identity = os.getenv("GEMINI_WORKER_ID")
 if not worker_identity:
-    worker_identity = f"{socket.gethostname()}-{os.getpid()}"
-    print(f"⚠️ 警告: 未配置 WORKER_ID，使用随机ID: {worker_identity}")
-CONSUMER_NAME = f"worker-{worker_identity}"
+    worker_identity = default_worker_identity()
+    debug_log("⚠️ 警告: 未配置 WORKER_ID，使用随机ID: %s", "WARNING", worker_identity)
+# 多进程模式下自动追加 -p<序号>，保证同组内消费者名唯一
+CONSUMER_NAME = consumer_name_for_process(f"worker-{worker_identity}")
 
 # 初始化 Redis 连接
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
@@ -53,14 +60,14 @@ def init_stream():
     """初始化 Stream 和 消费者组"""
     try:
         redis_client.xgroup_create(STREAM_KEY, GROUP_NAME, id='0', mkstream=True)
-        debug_log(f"消费者组 {GROUP_NAME} 就绪", "INFO")
+        debug_log("消费者组 %s 就绪", "INFO", GROUP_NAME)
     except redis.exceptions.ResponseError as e:
         if "BUSYGROUP" in str(e):
-            debug_log(f"消费者组 {GROUP_NAME} 已存在", "INFO")
+            debug_log("消费者组 %s 已存在", "INFO", GROUP_NAME)
         else:
             raise e
 
-def process_message(message_id, message_data, check_idempotency=True):
+def process_message(message_id, message_data, check_idempotency=True, ack_buffer=None, defer_results=False):
     """
     具体的 Worker 逻辑现在只是一个简单的入口配置
     """
@@ -73,45 +80,24 @@ def process_message(message_id, message_data, check_idempotency=True):
         message_data=message_data,
         check_idempotency=check_idempotency,
         refusal_keywords=GEMINI_REFUSAL_KEYWORDS,
-        request_timeout=120
+        request_timeout=REQUEST_TIMEOUT,
+        ack_buffer=ack_buffer,
+        defer_results=defer_results
     )
 
 def start_worker():
     debug_log("=" * 40, "INFO")
-    debug_log(f"🚀 Stream Worker 启动 (Fail Fast Mode): {CONSUMER_NAME}", "INFO")
+    debug_log("🚀 Stream Worker 启动 (Fail Fast Mode): %s", "INFO", CONSUMER_NAME)
+    pin_worker_cpu(worker_identity)
 
     init_stream()
 
-    # 1. 仅在启动时检查一次
-    recover_pending_tasks(
-        redis_client=redis_client,
-        stream_key=STREAM_KEY,
-        group_name=GROUP_NAME,
-        consumer_name=CONSUMER_NAME,
-        process_callback=process_message  # <--- 函数作为参数传递
+    # 单条消息最长处理时间：上传文件 (最多 60s) + LLM 请求超时
+    run_consumer_loop(
+        redis_client, STREAM_KEY, GROUP_NAME, CONSUMER_NAME, process_message,
+        message_timeout=REQUEST_TIMEOUT + 60
     )
 
-    debug_log("进入主循环监听...", "INFO")
-
-    # 2. 主循环 (不再有定时检查)
-    while True:
-        try:
-            # 阻塞读取新消息
-            response = redis_client.xreadgroup(
-                GROUP_NAME, CONSUMER_NAME, {STREAM_KEY: '>'}, count=1, block=2000
-            )
-
-            if not response:
-                continue
-
-            stream_name, messages = response[0]
-            for message_id, message_data in messages:
-                process_message(message_id, message_data, check_idempotency=False)
-
-        except Exception as e:
-            debug_log(f"主循环异常: {e}", "ERROR")
-            time.sleep(5)  # 防止 Redis 挂了导致死循环刷屏
-
 
 if __name__ == "__main__":
-    start_worker()
\ No newline at end of file
+    run_worker_processes(start_worker, WORKER_PROCESSES)
\ No newline at end of file
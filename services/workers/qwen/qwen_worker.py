@@ -1,20 +1,20 @@
-import json
 import os
 import time
-import socket
 from pathlib import Path
-from datetime import datetime
 from requests.exceptions import Timeout, ConnectTimeout, RequestException
+import orjson
 import redis
-import requests
 from dotenv import load_dotenv
 
 # === 导入共享模块 ===
-from common import models
-from common.database import SessionLocal
+from common.database import WorkerSession
 from common.logger import debug_log
-from common.models import TaskStatus
-from services.workers.core import parse_and_validate, claim_task, mark_task_failed, recover_pending_tasks
+from services.workers.core import (
+    parse_and_validate, claim_task, mark_task_failed, finish_task_success, defer_task_success, ack_message,
+    http_session, read_error_preview, extract_reply_text, JSON_HEADERS, CONNECT_TIMEOUT,
+    run_consumer_loop,
+    run_worker_processes, consumer_name_for_process, default_worker_identity, resolve_process_count, pin_worker_cpu
+)
 
 # --- 1. 环境配置 ---
 current_file_path = Path(__file__).resolve()
@@ -34,11 +34,17 @@ LLM_SERVICE_URL = os.getenv("LLM_SERVICE_URL", "http://192.168.202.155:11434/v1/
 # 队列配置
 STREAM_KEY = os.getenv("STREAM_KEY", "qwen_stream")
 GROUP_NAME = os.getenv("GROUP_NAME", "qwen_workers_group")
+# 单次 LLM 请求超时 (秒)
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", 300))
+# 并发数 / 批量读取 / XAUTOCLAIM 等消费配置在 services/workers/core/consumer.py，各 Worker 共用同一组环境变量
+# 本机起几个消费者进程 ("auto" = CPU 核数)，绕开 GIL；消费者组保证同一条消息只投递给其中一个
+WORKER_PROCESSES = resolve_process_count(os.getenv("WORKER_PROCESSES", 1))
 
 worker_identity = os.getenv("QWEN_WORKER_ID")
 if not worker_identity:
-    worker_identity = f"qwen-{socket.gethostname()}-{os.getpid()}"
-CONSUMER_NAME = f"worker-{worker_identity}"
+    worker_identity = default_worker_identity("qwen")
+# 多进程模式下自动追加 -p<序号>，保证同组内消费者名唯一
+CONSUMER_NAME = consumer_name_for_process(f"worker-{worker_identity}")
 
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
 
@@ -47,15 +53,15 @@ def init_stream():
     """初始化 Stream"""
     try:
         redis_client.xgroup_create(STREAM_KEY, GROUP_NAME, id='0', mkstream=True)
-        debug_log(f"🧠 Qwen 消费者组 {GROUP_NAME} 就绪", "INFO")
+        debug_log("🧠 Qwen 消费者组 %s 就绪", "INFO", GROUP_NAME)
     except redis.exceptions.ResponseError as e:
         if "BUSYGROUP" not in str(e):
             raise e
 
 
-def process_message(message_id, message_data, check_idempotency=True):
+def process_message(message_id, message_data, check_idempotency=True, ack_buffer=None, defer_results=False):
     """处理单条消息 (轻量级模式)"""
-    db = SessionLocal()
+    db = WorkerSession()
     task_data = parse_and_validate(
         redis_client, STREAM_KEY, GROUP_NAME, message_id, message_data, CONSUMER_NAME
     )
@@ -80,11 +86,11 @@ def process_message(message_id, message_data, check_idempotency=True):
             if not claim_task(db, task_id):
                 # 如果抢占失败 (返回False)，说明任务正在跑或跑完了
                 # 直接 ACK 告诉 Redis "这事不用我管了"
-                redis_client.xack(STREAM_KEY, GROUP_NAME, message_id)
+                ack_message(redis_client, STREAM_KEY, GROUP_NAME, message_id, ack_buffer)
                 return
 
-        debug_log(f"🧠 Qwen 开始请求: {task_id}", "REQUEST")
-        start_time = time.time()
+        debug_log("🧠 Qwen 开始请求: %s", "REQUEST", task_id)
+        start_time = time.monotonic()
 
         # --- 2. 构造请求 Payload (有状态模式) ---
         # 我们只把 conversation_id 传过去，假设下游服务能看懂
@@ -97,105 +103,79 @@ def process_message(message_id, message_data, check_idempotency=True):
         }
 
         # --- 3. 调用后端 API ---
-        debug_log(f"发送请求至: {LLM_SERVICE_URL}", "INFO")
-        response = requests.post(LLM_SERVICE_URL, json=payload, timeout=300)
+        debug_log("发送请求至: %s", "INFO", LLM_SERVICE_URL)
+        response = http_session.post(
+            LLM_SERVICE_URL,
+            data=orjson.dumps(payload),
+            headers=JSON_HEADERS,
+            timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT),
+            stream=True  # body 按需读取：成功时 .content 读全量，失败时只读一小段
+        )
 
         if response.status_code == 200:
-            res_json = response.json()
-
-            # 这里需要根据你的后端返回格式来适配
-            # 如果是标准 OpenAI 格式：
-            if 'choices' in res_json:
-                ai_text = res_json['choices'][0]['message']['content']
-            # 如果是你的 Gemini 服务格式：
-            elif 'response' in res_json:
-                ai_text = res_json['response']
+            # 标准 OpenAI 格式 / Gemini 服务的 response 字段都能识别
+            ai_text = extract_reply_text(response.content)
+
+            # 更新数据库 (任务结果 + 会话活跃时间，一次提交)
+            cost_time = round(time.monotonic() - start_time, 2)
+            if defer_results:
+                # 成功结果交给后台写入线程：提交之后再 ACK
+                defer_task_success(
+                    redis_client, STREAM_KEY, GROUP_NAME, message_id,
+                    task_id, ai_text, cost_time, conversation_id
+                )
             else:
-                ai_text = str(res_json)
-
-            # 更新数据库
-            task = db.query(models.Task).filter(models.Task.task_id == task_id).first()
-            if task:
-                task.response_text = ai_text
-                task.status = TaskStatus.SUCCESS
-                task.cost_time = round(time.time() - start_time, 2)
-
-                # 更新会话时间
-                if conversation_id:
-                    conv = db.query(models.Conversation).filter(
-                        models.Conversation.conversation_id == conversation_id).first()
-                    if conv:
-                        conv.updated_at = datetime.now()
-
-                db.commit()
-                debug_log(f"✅ 回答完毕 (耗时: {task.cost_time}s)", "SUCCESS")
-
-            redis_client.xack(STREAM_KEY, GROUP_NAME, message_id)
+                finish_task_success(db, task_id, ai_text, cost_time, conversation_id)
+                ack_message(redis_client, STREAM_KEY, GROUP_NAME, message_id, ack_buffer)
 
         else:
-            error_msg = f"Qwen API Error: {response.status_code} - {response.text[:200]}"
+            error_msg = f"Qwen API Error: {response.status_code} - {read_error_preview(response, 200)}"
             debug_log(error_msg, "ERROR")
             mark_task_failed(db, task_id, error_msg)
-            redis_client.xack(STREAM_KEY, GROUP_NAME, message_id)
+            ack_message(redis_client, STREAM_KEY, GROUP_NAME, message_id, ack_buffer)
 
     except ConnectTimeout:
         error_msg = "无法连接到 AI 服务 (Connection Timeout)。请检查 API 地址或防火墙配置。"
-        debug_log(f"🔌 {error_msg}", "ERROR")
+        debug_log("🔌 %s", "ERROR", error_msg)
         mark_task_failed(db, task_id, "系统内部连接异常，请联系管理员")
-        redis_client.xack(STREAM_KEY, GROUP_NAME, message_id)
+        ack_message(redis_client, STREAM_KEY, GROUP_NAME, message_id, ack_buffer)
 
     except Timeout:
         error_msg = "AI 生成超时（超过指定时间无响应），请稍后重试。"
-        debug_log(f"⏳ {error_msg}", "ERROR")
+        debug_log("⏳ %s", "ERROR", error_msg)
         mark_task_failed(db, task_id, error_msg)
-        redis_client.xack(STREAM_KEY, GROUP_NAME, message_id)
+        ack_message(redis_client, STREAM_KEY, GROUP_NAME, message_id, ack_buffer)
 
     except RequestException as e:
         error_msg = f"网络连接异常: {str(e)}"
         debug_log(error_msg, "ERROR")
         mark_task_failed(db, task_id, "后端服务连接中断")
-        redis_client.xack(STREAM_KEY, GROUP_NAME, message_id)
+        ack_message(redis_client, STREAM_KEY, GROUP_NAME, message_id, ack_buffer)
 
     except Exception as e:
         db.rollback()
-        debug_log(f"Worker 内部崩溃: {e}", "ERROR")
+        debug_log("Worker 内部崩溃: %s", "ERROR", e)
         mark_task_failed(db, task_id, "系统内部处理错误")
 
-        redis_client.xack(STREAM_KEY, GROUP_NAME, message_id)
+        ack_message(redis_client, STREAM_KEY, GROUP_NAME, message_id, ack_buffer)
 
 
     finally:
-
+        # 归还连接、清空 identity map；Session 对象本身留在线程里复用
         db.close()
 
 def start_worker():
     debug_log("=" * 40, "INFO")
-    debug_log(f"🚀 Qwen Worker 启动 | 监听: {STREAM_KEY}", "INFO")
+    debug_log("🚀 Qwen Worker 启动 | 监听: %s", "INFO", STREAM_KEY)
+    pin_worker_cpu(worker_identity)
 
     init_stream()
 
-    recover_pending_tasks(
-        redis_client=redis_client,
-        stream_key=STREAM_KEY,
-        group_name=GROUP_NAME,
-        consumer_name=CONSUMER_NAME,
-        process_callback=process_message  # <--- 函数作为参数传递
+    run_consumer_loop(
+        redis_client, STREAM_KEY, GROUP_NAME, CONSUMER_NAME, process_message,
+        message_timeout=REQUEST_TIMEOUT
     )
 
-    while True:
-        try:
-            # 阻塞读取
-            response = redis_client.xreadgroup(
-                GROUP_NAME, CONSUMER_NAME, {STREAM_KEY: '>'}, count=1, block=2000
-            )
-            if response:
-                for stream, msgs in response:
-                    for msg_id, msg_data in msgs:
-                        process_message(msg_id, msg_data, check_idempotency=False)
-        except Exception as e:
-            debug_log(f"主循环异常: {e}", "ERROR")
-            time.sleep(5)
-
 
 if __name__ == "__main__":
-    start_worker()
+    run_worker_processes(start_worker, WORKER_PROCESSES)
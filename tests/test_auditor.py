@@ -0,0 +1,49 @@
+# tests/test_auditor.py
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.getcwd())
+
+from services.workers.core.data import auditor
+from services.workers.core.data.auditor import _compile_refusal_pattern, reject_refusal
+
+
+def test_matches_any_keyword():
+    pattern = _compile_refusal_pattern(("无法回答", "I can't help"))
+    assert pattern.search("抱歉，我无法回答这个问题")
+    assert pattern.search("Sorry, I can't help with that")
+    assert pattern.search("这是一个正常的回答") is None
+
+
+def test_regex_metacharacters_are_escaped():
+    """关键词按字面匹配：. * ( ) ? 等不能被当成正则语法"""
+    pattern = _compile_refusal_pattern(("a.b", "(x)", "why?", "1+1"))
+    assert pattern.search("a.b")
+    assert pattern.search("axb") is None
+    assert pattern.search("(x)")
+    assert pattern.search("x") is None
+    assert pattern.search("why?")
+    assert pattern.search("wh") is None
+    assert pattern.search("1+1")
+    assert pattern.search("11") is None
+
+
+def test_pattern_is_cached_per_keyword_set():
+    keywords = ("拒绝", "refuse")
+    assert _compile_refusal_pattern(keywords) is _compile_refusal_pattern(tuple(keywords))
+
+
+def test_reject_refusal_marks_task_failed(monkeypatch):
+    failed = []
+    monkeypatch.setattr(auditor, "mark_task_failed", lambda db, task_id, msg: failed.append((task_id, msg)))
+    assert reject_refusal(None, "t1", "抱歉，我无法回答", ["无法回答"]) is True
+    assert failed == [("t1", "生成失败: 抱歉，我无法回答")]
+
+
+def test_reject_refusal_passes_normal_text(monkeypatch):
+    failed = []
+    monkeypatch.setattr(auditor, "mark_task_failed", lambda db, task_id, msg: failed.append(task_id))
+    assert reject_refusal(None, "t1", "这是一个正常的回答", ["无法回答"]) is False
+    assert reject_refusal(None, "t1", "无法回答", None) is False
+    assert failed == []
@@ -0,0 +1,65 @@
+# tests/test_backoff.py
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.getcwd())
+
+import pytest
+
+from services.workers.core import backoff
+from services.workers.core.backoff import LoopBackoff
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """把 time.sleep 换成记录器，只看每次要睡多久，不真的睡"""
+    recorded = []
+    monkeypatch.setattr(backoff.time, "sleep", recorded.append)
+    return recorded
+
+
+@pytest.fixture
+def logs(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(backoff, "debug_log", lambda msg, level="INFO": recorded.append((level, msg)))
+    return recorded
+
+
+def test_delay_doubles_up_to_cap(sleeps, logs):
+    b = LoopBackoff(base=0.1, cap=1.0, failure_threshold=100)
+    for _ in range(6):
+        b.failure()
+    assert sleeps == pytest.approx([0.1, 0.2, 0.4, 0.8, 1.0, 1.0])
+
+
+def test_breaker_opens_after_threshold(sleeps, logs):
+    b = LoopBackoff(base=1, cap=4, failure_threshold=4, open_delay=30)
+    for _ in range(6):
+        b.failure()
+    # 前 3 次指数退避，第 4 次起熔断：固定等 open_delay
+    assert sleeps == [1, 2, 4, 30, 30, 30]
+    # 熔断告警只打一次
+    assert [level for level, _ in logs] == ["ERROR"]
+
+
+def test_success_resets_delay(sleeps, logs):
+    b = LoopBackoff(base=1, cap=8, failure_threshold=10)
+    b.failure()
+    b.failure()
+    b.success()
+    b.failure()
+    assert sleeps == [1, 2, 1]
+    assert b.failures == 1
+    # 未熔断过，恢复时不打日志
+    assert logs == []
+
+
+def test_success_after_breaker_closes_it(sleeps, logs):
+    b = LoopBackoff(base=1, cap=4, failure_threshold=2, open_delay=30)
+    b.failure()
+    b.failure()
+    b.success()
+    b.failure()
+    assert sleeps == [1, 30, 1]
+    assert [level for level, _ in logs] == ["ERROR", "INFO"]
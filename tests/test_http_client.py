@@ -0,0 +1,34 @@
+# tests/test_http_client.py
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.getcwd())
+
+import pytest
+
+from services.workers.core.io.http_client import extract_reply_text
+
+
+def test_openai_format():
+    body = b'{"choices": [{"message": {"role": "assistant", "content": "\xe4\xbd\xa0\xe5\xa5\xbd"}}]}'
+    assert extract_reply_text(body) == "你好"
+
+
+def test_response_field():
+    assert extract_reply_text(b'{"response": "ok"}') == "ok"
+
+
+@pytest.mark.parametrize("body", [
+    b'{"choices": [], "response": "ok"}',             # IndexError
+    b'{"choices": [{"text": "x"}], "response": "ok"}',  # KeyError
+    b'{"choices": "x", "response": "ok"}',            # TypeError
+])
+def test_malformed_choices_falls_back_to_response(body):
+    assert extract_reply_text(body) == "ok"
+
+
+def test_unknown_shape_is_stringified():
+    assert extract_reply_text(b'{"data": 1}') == "{'data': 1}"
+    assert extract_reply_text(b'[1, 2]') == "[1, 2]"
+    assert extract_reply_text(b'"plain"') == "plain"
@@ -11,7 +11,7 @@ sys.path.append(os.getcwd())
 from common.database import SessionLocal
 from common import models
 from common.models import TaskStatus
-from common.utils.worker_utils import claim_task
+from services.workers.core import claim_task
 
 
 def setup_test_task():
@@ -0,0 +1,129 @@
+# tests/test_message_recovery.py
+import sys
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到路径
+sys.path.append(os.getcwd())
+
+import orjson
+import pytest
+
+from common.models import TaskStatus
+from services.workers.core.io import message_io
+
+Row = namedtuple("Row", "task_id status")
+
+
+class FakeQuery:
+    def __init__(self, session, columns):
+        self.session = session
+        self.columns = columns
+
+    def filter(self, *criteria):
+        return self
+
+    def all(self):
+        return self.session.rows
+
+    def update(self, values, synchronize_session=None):
+        self.session.updates.append(values)
+        return sum(1 for row in self.session.rows if row.status == TaskStatus.PROCESSING)
+
+
+class FakeSession:
+    """按给定的任务行回答状态查询，记录僵尸任务 UPDATE 和 commit"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.updates = []
+        self.commits = 0
+        self.closed = False
+
+    def query(self, *columns):
+        return FakeQuery(self, columns)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRedis:
+    def __init__(self):
+        self.acked = []
+
+    def xack(self, stream_key, group_name, *ids):
+        self.acked.append(list(ids))
+
+
+def _message(task_id, age_ms=0):
+    message_id = f"{int(time.time() * 1000) - age_ms}-0".encode()
+    return message_id, {b"payload": orjson.dumps({"task_id": task_id})}
+
+
+@pytest.fixture
+def recover(monkeypatch):
+    """用假的 Session / Redis 跑一次 _recover_messages，返回 (redis, session, 被回调的消息 ID)"""
+    def run(messages, rows, expire_ms=60000):
+        session = FakeSession(rows)
+        monkeypatch.setattr(message_io, "SessionLocal", lambda: session)
+        redis_client = FakeRedis()
+        processed = []
+
+        def callback(message_id, message_data, check_idempotency, ack_buffer):
+            assert check_idempotency is True
+            processed.append(message_id)
+            ack_buffer.append(message_id)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            message_io._recover_messages(
+                redis_client, "stream", "group", "consumer", messages, callback, executor, expire_ms=expire_ms
+            )
+        return redis_client, session, processed
+    return run
+
+
+def test_expired_and_settled_are_acked_without_callback(recover):
+    expired = _message("t-old", age_ms=120000)
+    done = _message("t-done")
+    failed = _message("t-failed")
+    pending = _message("t-pending")
+    redis_client, session, processed = recover(
+        [expired, done, failed, pending],
+        [Row("t-done", TaskStatus.SUCCESS), Row("t-failed", TaskStatus.FAILED), Row("t-pending", TaskStatus.PENDING)]
+    )
+    # 过期 + 已完成消息一次 XACK，待恢复消息回调后再一次 XACK
+    assert redis_client.acked == [[expired[0], done[0], failed[0]], [pending[0]]]
+    assert processed == [pending[0]]
+    assert session.updates == []
+    assert session.closed
+
+
+def test_zombie_tasks_are_reset_and_replayed(recover):
+    zombie = _message("t-zombie")
+    redis_client, session, processed = recover([zombie], [Row("t-zombie", TaskStatus.PROCESSING)])
+    assert session.updates == [{"status": TaskStatus.PENDING}]
+    assert session.commits == 1
+    assert processed == [zombie[0]]
+    assert redis_client.acked == [[zombie[0]]]
+
+
+def test_expiry_disabled(recover):
+    old = _message("t-old", age_ms=10 ** 9)
+    redis_client, _, processed = recover([old], [Row("t-old", TaskStatus.PENDING)], expire_ms=None)
+    assert processed == [old[0]]
+
+
+def test_unparseable_payload_goes_to_callback(recover):
+    """解析失败的消息不查库，交给 Worker 回调统一走死信流程"""
+    broken = (f"{int(time.time() * 1000)}-0".encode(), {b"payload": b"{not json"})
+    redis_client, session, processed = recover([broken], [])
+    assert processed == [broken[0]]
+    assert session.commits == 0
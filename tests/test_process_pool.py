@@ -0,0 +1,100 @@
+# tests/test_process_pool.py
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.getcwd())
+
+import pytest
+
+from services.workers.core import process_pool
+from services.workers.core.process_pool import (
+    PROCESS_INDEX_ENV, resolve_process_count, consumer_name_for_process, default_worker_identity, pin_worker_cpu
+)
+
+
+@pytest.mark.parametrize("value", ["auto", "AUTO", " auto ", "0", 0])
+def test_resolve_process_count_auto(monkeypatch, value):
+    monkeypatch.setattr(process_pool.os, "cpu_count", lambda: 6)
+    assert resolve_process_count(value) == 6
+
+
+def test_resolve_process_count_auto_without_cpu_count(monkeypatch):
+    monkeypatch.setattr(process_pool.os, "cpu_count", lambda: None)
+    assert resolve_process_count("auto") == 1
+
+
+@pytest.mark.parametrize("value, expected", [(1, 1), ("3", 3), ("-2", 1)])
+def test_resolve_process_count_explicit(value, expected):
+    assert resolve_process_count(value) == expected
+
+
+def test_resolve_process_count_rejects_garbage():
+    with pytest.raises(ValueError):
+        resolve_process_count("many")
+
+
+def test_consumer_name_single_process(monkeypatch):
+    monkeypatch.delenv(PROCESS_INDEX_ENV, raising=False)
+    assert consumer_name_for_process("worker-a") == "worker-a"
+
+
+def test_consumer_name_with_process_index(monkeypatch):
+    monkeypatch.setenv(PROCESS_INDEX_ENV, "2")
+    assert consumer_name_for_process("worker-a") == "worker-a-p2"
+
+
+def test_default_identity_is_stable_in_process_mode(monkeypatch):
+    """多进程模式下默认身份不含 pid，子进程重启后消费者名不变"""
+    monkeypatch.setattr(process_pool.socket, "gethostname", lambda: "host1")
+    monkeypatch.setenv(PROCESS_INDEX_ENV, "0")
+    assert default_worker_identity("qwen") == "qwen-host1"
+    assert default_worker_identity() == "host1"
+
+
+def test_default_identity_includes_pid_in_single_process(monkeypatch):
+    monkeypatch.setattr(process_pool.socket, "gethostname", lambda: "host1")
+    monkeypatch.setattr(process_pool.os, "getpid", lambda: 4321)
+    monkeypatch.delenv(PROCESS_INDEX_ENV, raising=False)
+    assert default_worker_identity("qwen") == "qwen-host1-4321"
+
+
+@pytest.fixture
+def affinity(monkeypatch):
+    """伪造 sched_getaffinity / sched_setaffinity，记录最终绑定的核"""
+    pinned = []
+    monkeypatch.setattr(process_pool, "CPU_AFFINITY", True)
+    monkeypatch.setattr(process_pool.os, "sched_getaffinity", lambda pid: {2, 4, 6}, raising=False)
+    monkeypatch.setattr(process_pool.os, "sched_setaffinity", lambda pid, cpus: pinned.append(cpus), raising=False)
+    monkeypatch.delenv(PROCESS_INDEX_ENV, raising=False)
+    return pinned
+
+
+def test_pin_worker_cpu_disabled(monkeypatch, affinity):
+    monkeypatch.setattr(process_pool, "CPU_AFFINITY", False)
+    pin_worker_cpu("gemini-worker-1")
+    assert affinity == []
+
+
+def test_pin_worker_cpu_uses_process_index(monkeypatch, affinity):
+    """只在允许的核里选 (容器 cpuset)，序号对可用核数取模"""
+    monkeypatch.setenv(PROCESS_INDEX_ENV, "4")
+    pin_worker_cpu("gemini-worker-1")
+    assert affinity == [{4}]
+
+
+def test_pin_worker_cpu_uses_worker_id_suffix(affinity):
+    pin_worker_cpu("gemini-worker-2")
+    assert affinity == [{6}]
+
+
+def test_pin_worker_cpu_defaults_to_first_core(affinity):
+    pin_worker_cpu("gemini-worker")
+    assert affinity == [{2}]
+
+
+def test_pin_worker_cpu_ignores_os_error(monkeypatch, affinity):
+    def fail(pid, cpus):
+        raise OSError("not permitted")
+    monkeypatch.setattr(process_pool.os, "sched_setaffinity", fail)
+    pin_worker_cpu("gemini-worker-1")  # 不抛异常
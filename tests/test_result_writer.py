@@ -0,0 +1,94 @@
+# tests/test_result_writer.py
+import sys
+import os
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+sys.path.append(os.getcwd())
+
+import pytest
+
+from services.workers.core.data import result_writer
+
+
+class FakeSession:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    """伪造 WorkerSession / flush_task_results / flush_acks，记录落库的行和 ACK 的消息"""
+    state = SimpleNamespace(session=FakeSession(), flushed=[], acks=[], written=set(), error=None)
+
+    def fake_flush(db, rows):
+        state.flushed.append([row["task_id"] for row in rows])
+        if state.error:
+            raise state.error
+        return state.written
+
+    monkeypatch.setattr(result_writer, "database", SimpleNamespace(WorkerSession=lambda: state.session))
+    monkeypatch.setattr(result_writer, "flush_task_results", fake_flush)
+    monkeypatch.setattr(
+        result_writer, "flush_acks",
+        lambda redis_client, stream_key, group_name, ids: state.acks.append((redis_client, stream_key, group_name, list(ids)))
+    )
+    return state
+
+
+def _job(redis_client, stream_key, message_id, task_id):
+    row = {"task_id": task_id, "response_text": "ok", "cost_time": 1.0, "conversation_id": None}
+    return redis_client, stream_key, "group", message_id, row
+
+
+def test_only_written_tasks_are_acked(writer):
+    redis_client = object()
+    writer.written = {"t1", "t3"}
+    result_writer._write_jobs([
+        _job(redis_client, "s", "1-0", "t1"),
+        _job(redis_client, "s", "2-0", "t2"),
+        _job(redis_client, "s", "3-0", "t3"),
+    ])
+    assert writer.flushed == [["t1", "t2", "t3"]]
+    assert writer.acks == [(redis_client, "s", "group", ["1-0", "3-0"])]
+    assert writer.session.closed
+
+
+def test_acks_grouped_per_stream(writer):
+    redis_client = object()
+    writer.written = {"t1", "t2", "t3"}
+    result_writer._write_jobs([
+        _job(redis_client, "a", "1-0", "t1"),
+        _job(redis_client, "b", "2-0", "t2"),
+        _job(redis_client, "a", "3-0", "t3"),
+    ])
+    assert writer.acks == [
+        (redis_client, "a", "group", ["1-0", "3-0"]),
+        (redis_client, "b", "group", ["2-0"]),
+    ]
+
+
+def test_nothing_acked_when_flush_raises(writer):
+    """落库异常时一条都不 ACK，消息留在 PEL 里由恢复流程重放"""
+    writer.error = RuntimeError("db down")
+    result_writer._write_jobs([_job(object(), "s", "1-0", "t1")])
+    assert writer.acks == []
+    assert writer.session.closed
+
+
+def test_ack_failure_does_not_block_other_streams(writer, monkeypatch):
+    redis_client = object()
+    writer.written = {"t1", "t2"}
+    acked = []
+
+    def flaky_acks(redis_client, stream_key, group_name, ids):
+        if stream_key == "a":
+            raise ConnectionError("redis down")
+        acked.append(stream_key)
+
+    monkeypatch.setattr(result_writer, "flush_acks", flaky_acks)
+    result_writer._write_jobs([_job(redis_client, "a", "1-0", "t1"), _job(redis_client, "b", "2-0", "t2")])
+    assert acked == ["b"]
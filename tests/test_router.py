@@ -0,0 +1,90 @@
+# tests/test_router.py
+import sys
+import os
+from collections import namedtuple
+
+# 添加项目根目录到路径
+sys.path.append(os.getcwd())
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from services.workers.core.dispatch import router
+
+Node = namedtuple("Node", "node_url dispatched_tasks current_tasks")
+Route = namedtuple("Route", "node_url old_url")
+
+
+class FakeResult:
+    def __init__(self, row):
+        self.row = row
+
+    def one(self):
+        return self.row
+
+
+class FakeSession:
+    """只记录 execute 调用，按给定的 (node_url, old_url) 模拟 UPSERT ... RETURNING"""
+
+    def __init__(self, old_url=None, keep_old=False):
+        self.old_url = old_url
+        self.keep_old = keep_old
+        self.statements = []
+
+    def execute(self, stmt):
+        self.statements.append(stmt)
+        params = stmt.compile(dialect=postgresql.dialect()).params
+        new_url = params["node_url"]
+        node_url = self.old_url if self.keep_old else new_url
+        return FakeResult(Route(node_url, self.old_url))
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    current = []
+    monkeypatch.setattr(router, "_get_active_nodes", lambda db: current)
+    return current
+
+
+def test_only_idle_nodes_are_chosen(nodes):
+    nodes[:] = [Node("http://busy", 1, 0), Node("http://running", 0, 2), Node("http://idle", 0, 0)]
+    for _ in range(20):
+        url, changed = router.get_database_target_url(FakeSession(), None)
+        assert url == "http://idle/v1/chat/completions"
+        assert changed is False
+
+
+def test_all_busy_fails_fast_without_touching_routes(nodes):
+    nodes[:] = [Node("http://a", 1, 0), Node("http://b", 0, 1)]
+    db = FakeSession()
+    assert router.get_database_target_url(db, "conv-1") == (None, False)
+    assert db.statements == []
+
+
+def test_no_healthy_nodes(nodes):
+    db = FakeSession()
+    assert router.get_database_target_url(db, "conv-1") == (None, False)
+    assert db.statements == []
+
+
+def test_sticky_route_reuses_old_node(nodes):
+    nodes[:] = [Node("http://a", 0, 0), Node("http://b", 0, 0)]
+    db = FakeSession(old_url="http://b", keep_old=True)
+    url, changed = router.get_database_target_url(db, "conv-1")
+    assert url == "http://b/v1/chat/completions"
+    assert changed is False
+    assert len(db.statements) == 1
+
+
+def test_moved_route_is_reported_as_changed(nodes):
+    nodes[:] = [Node("http://a", 0, 0)]
+    db = FakeSession(old_url="http://gone")
+    url, changed = router.get_database_target_url(db, "conv-1")
+    assert url == "http://a/v1/chat/completions"
+    assert changed is True
+
+
+def test_new_route_is_reported_as_changed(nodes):
+    nodes[:] = [Node("http://a", 0, 0)]
+    url, changed = router.get_database_target_url(FakeSession(old_url=None), "conv-1")
+    assert changed is True
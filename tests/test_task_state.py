@@ -0,0 +1,80 @@
+# tests/test_task_state.py
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.getcwd())
+
+from services.workers.core.data import task_state
+from services.workers.core.data.task_state import flush_task_results
+
+
+class FakeResult:
+    def __init__(self, ids):
+        self.ids = ids
+
+    def scalars(self):
+        return iter(self.ids)
+
+
+class FakeSession:
+    """第一条 execute 模拟批量 UPDATE ... RETURNING task_id；fail=True 时直接抛异常"""
+
+    def __init__(self, returned=(), fail=False):
+        self.returned = list(returned)
+        self.fail = fail
+        self.executed = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    def execute(self, stmt):
+        if self.fail:
+            raise RuntimeError("bulk update failed")
+        self.executed += 1
+        return FakeResult(self.returned)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def _row(task_id, conversation_id=None):
+    return {"task_id": task_id, "response_text": "ok", "cost_time": 1.0, "conversation_id": conversation_id}
+
+
+def test_empty_buffer():
+    db = FakeSession()
+    assert flush_task_results(db, []) == set()
+    assert db.executed == 0
+
+
+def test_bulk_write_returns_written_ids():
+    db = FakeSession(returned=["t1"])
+    buffer = [_row("t1"), _row("t2")]
+    assert flush_task_results(db, buffer) == {"t1"}
+    assert buffer == []
+    assert db.executed == 1  # 没有会话要刷新，只有一条批量 UPDATE
+    assert db.commits == 1
+
+
+def test_bulk_write_touches_conversations_of_written_tasks():
+    db = FakeSession(returned=["t1"])
+    assert flush_task_results(db, [_row("t1", "c1"), _row("t2", "c2")]) == {"t1"}
+    assert db.executed == 2
+
+
+def test_bulk_failure_falls_back_to_single_rows(monkeypatch):
+    """批量写失败时回滚并逐条重试，只返回逐条写成功的任务"""
+    calls = []
+
+    def fake_finish(db, task_id, response_text, cost_time, conversation_id=None):
+        calls.append(task_id)
+        return task_id != "t2"
+
+    monkeypatch.setattr(task_state, "finish_task_success", fake_finish)
+    db = FakeSession(fail=True)
+    assert flush_task_results(db, [_row("t1"), _row("t2"), _row("t3")]) == {"t1", "t3"}
+    assert calls == ["t1", "t2", "t3"]
+    assert db.rollbacks == 1